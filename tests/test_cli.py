@@ -0,0 +1,77 @@
+# ThotKeeper -- a personal daily journal application.
+#
+# Copyright (c) 2004-2025 C. Michael Pilato.  All rights reserved.
+#
+# By using this file, you agree to the terms and conditions set forth in
+# the LICENSE file which can be found at the top level of the ThotKeeper
+# distribution.
+#
+# Website: https://github.com/cmpilato/thotkeeper
+
+"""Tests for the headless command-line subcommands."""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+_TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _TOP_DIR)
+
+from thotkeeper.entries import (TKEntries, TKEntry)  # noqa: E402
+from thotkeeper.parser import (parse_data, unparse_data)  # noqa: E402
+
+
+class TKCommandTests(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='tk-test-')
+        self.datafile = os.path.join(self.workdir, 'diary.tkj')
+        entries = TKEntries()
+        entries.store_entry(TKEntry('', 'old', 'an old entry',
+                                    2000, 1, 1, 1, ['foo']))
+        unparse_data(self.datafile, entries)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def thotkeeper(self, *args):
+        """Run the thotkeeper subcommand ARGS against our datafile,
+        returning its standard output."""
+        result = subprocess.run(
+            [sys.executable, '-m', 'thotkeeper', '--file', self.datafile] +
+            list(args), cwd=_TOP_DIR, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout
+
+    def test_add_on_new_day(self):
+        output = self.thotkeeper('add', '--date', '2001-01-05',
+                                 '--subject', 'hi', '--tag', 'Foo/Bar',
+                                 'hello world')
+        self.assertEqual(output, 'Added 2001-01-05 (1)\n')
+        output = self.thotkeeper('add', '--date', '2001-01-05', 'again')
+        self.assertEqual(output, 'Added 2001-01-05 (2)\n')
+
+        self.assertEqual(self.thotkeeper('list').splitlines(),
+                         ['2000-01-01 1   old [foo]',
+                          '2001-01-05 1   hi [foo/bar]',
+                          '2001-01-05 2   (no subject)'])
+        self.assertIn('hello world', self.thotkeeper('show', '2001-01-05',
+                                                     '1'))
+
+        # Both from the change log, and once compacted into the datafile.
+        for compact in (False, True):
+            entries = parse_data(self.datafile)
+            if compact:
+                unparse_data(self.datafile, entries)
+                entries = parse_data(self.datafile)
+            self.assertEqual(entries.get_ids(2001, 1, 5), [1, 2])
+            entry = entries.get_entry(2001, 1, 5, 1)
+            self.assertEqual(entry.get_text(), 'hello world')
+            self.assertEqual(entry.get_tags(), ('foo/bar',))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# ThotKeeper -- a personal daily journal application.
+#
+# Copyright (c) 2004-2025 C. Michael Pilato.  All rights reserved.
+#
+# By using this file, you agree to the terms and conditions set forth in
+# the LICENSE file which can be found at the top level of the ThotKeeper
+# distribution.
+#
+# Website: https://github.com/cmpilato/thotkeeper
+
+"""Tests for background saves."""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from thotkeeper.entries import (TKEntries, TKEntry)  # noqa: E402
+from thotkeeper.parser import (get_changelog_mark,  # noqa: E402
+                               log_changes, parse_data, unparse_data)
+from thotkeeper.saver import (TKEntriesSnapshot,  # noqa: E402
+                              TKSaveScheduler)
+
+
+class TKSaveSchedulerTests(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='tk-test-')
+        self.datafile = os.path.join(self.workdir, 'diary.tkj')
+        self.entries = TKEntries()
+        self.entries.store_entry(TKEntry('', 'other', 'text',
+                                         2001, 1, 2, 1, ['z']))
+        unparse_data(self.datafile, self.entries)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_rename_during_pending_save(self):
+        entry = TKEntry('', 'subject', 'text', 2001, 1, 1, 1, ['a', 'a/c'])
+        self.entries.store_entry(entry)
+        log_changes(self.datafile, [entry])
+        snapshot = TKEntriesSnapshot(self.entries)
+        self.entries.rename_tag('a', 'b')
+        self.assertEqual(snapshot.entries[0].get_tags(), ('a', 'a/c'))
+        self.assertEqual(self.entries.get_entry(2001, 1, 1, 1).get_tags(),
+                         ('b', 'b/c'))
+
+        # A change logged while the save is pending must survive it,
+        # without the older, already-saved records being replayed.
+        saver = TKSaveScheduler(delay=60)
+        saver.schedule(self.datafile, self.entries)
+        self.entries.remove_entry(2001, 1, 2, 1)
+        log_changes(self.datafile, removed=[(2001, 1, 2, 1)])
+        saver.flush()
+        entries = parse_data(self.datafile)
+        self.assertEqual([(x.get_subject(), x.get_tags()) for x in entries],
+                         [('subject', ('b', 'b/c'))])
+
+    def test_overlapping_saves(self):
+        # Save A, and while that's being written, save B.  The first
+        # write trims the log, and then C is logged before the second
+        # write trims it again.  Whether C's record is shorter or longer
+        # than A's, it must survive the second trim (and so, reloads).
+        for text in ('', 'x' * 1000):
+            entries = TKEntries()
+            entries.store_entry(TKEntry('', 'kept', 'text',
+                                        2001, 1, 1, 1, []))
+            entries.store_entry(TKEntry('', 'gone', 'text',
+                                        2001, 1, 3, 1, []))
+            unparse_data(self.datafile, entries)
+            saves = []
+            for subject, day in (('A', 4), ('B', 5)):
+                entry = TKEntry('', subject, 'text' * 50,
+                                2001, 1, day, 1, [])
+                entries.store_entry(entry)
+                log_changes(self.datafile, [entry])
+                saves.append((TKEntriesSnapshot(entries),
+                              get_changelog_mark(self.datafile)))
+            unparse_data(self.datafile, *saves[0])
+            if text:
+                entry = TKEntry('', 'C', text, 2001, 1, 6, 1, [])
+                entries.store_entry(entry)
+                log_changes(self.datafile, [entry])
+            else:
+                entries.remove_entry(2001, 1, 3, 1)
+                log_changes(self.datafile, removed=[(2001, 1, 3, 1)])
+            unparse_data(self.datafile, *saves[1])
+            self.assertEqual([x.get_subject()
+                              for x in parse_data(self.datafile)],
+                             [x.get_subject() for x in entries])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# ThotKeeper -- a personal daily journal application.
+#
+# Copyright (c) 2004-2025 C. Michael Pilato.  All rights reserved.
+#
+# By using this file, you agree to the terms and conditions set forth in
+# the LICENSE file which can be found at the top level of the ThotKeeper
+# distribution.
+#
+# Website: https://github.com/cmpilato/thotkeeper
+
+"""Tests for full-text searches."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from thotkeeper.entries import (TKEntries, TKEntry)  # noqa: E402
+from thotkeeper.search import (TKSearchIndex, search_entries)  # noqa: E402
+
+
+class TKSearchTests(unittest.TestCase):
+    def setUp(self):
+        self.entries = TKEntries()
+        self.entries.store_entry(TKEntry('', 'Red roses', 'The quick fox.',
+                                         2001, 1, 1, 1, ['garden']))
+        self.entries.store_entry(TKEntry('', 'Paris', 'Quick, the fox!',
+                                         2001, 1, 2, 1,
+                                         ['travel/europe']))
+        self.index = TKSearchIndex(self.entries)
+
+    def assertSearch(self, query, expected):
+        self.assertEqual(self.index.search(query), expected)
+        self.assertEqual(search_entries(self.entries, query), expected)
+
+    def test_queries(self):
+        self.assertSearch('fox', [(2001, 1, 1, 1), (2001, 1, 2, 1)])
+        self.assertSearch('"the quick"', [(2001, 1, 1, 1)])
+        self.assertSearch('"quick the fox"', [(2001, 1, 2, 1)])
+        self.assertSearch('"fox quick"', [])
+        self.assertSearch('"travel europe"', [(2001, 1, 2, 1)])
+        self.assertSearch('garden OR paris', [(2001, 1, 1, 1),
+                                              (2001, 1, 2, 1)])
+        self.assertSearch('garden paris', [])
+        self.assertSearch('qui', [])
+
+        # Phrases don't span the end of one field and the start of
+        # the next.
+        self.assertSearch('"roses the"', [])
+        self.assertSearch('"fox travel"', [])
+
+    def test_changes(self):
+        self.entries.store_entry(TKEntry('', 'Home', 'The quick trip.',
+                                         2001, 1, 2, 1, []))
+        self.assertSearch('"the quick"', [(2001, 1, 1, 1), (2001, 1, 2, 1)])
+        self.entries.remove_entry(2001, 1, 1, 1)
+        self.assertSearch('"the quick"', [(2001, 1, 2, 1)])
+        self.assertSearch('fox', [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -31,6 +31,11 @@ def main():
     parser.add_argument('--update-check',
                         action='store_true',
                         help='check for a new version of ThotKeeper')
+    subparsers = parser.add_subparsers(
+        dest='command', metavar='COMMAND',
+        title='commands (run without the GUI)')
+    from .cli import add_subcommands
+    add_subcommands(subparsers)
     args = parser.parse_args()
 
     # Just a version check?  No sweat.
@@ -49,6 +54,12 @@ def main():
             sys.exit(1)
         return
 
+    # Running a headless command?  That's easy, too.
+    if args.command:
+        from .cli import run
+        run(args)
+        return
+
     # If we get here, it's time to fire up the GUI application!
     from .app import ThotKeeper
     tk = ThotKeeper(args.file)
@@ -10,14 +10,20 @@
 
 import os
 import os.path
+import threading
 import time
 import wx
+from bisect import bisect_left
 from wx.adv import (GenericCalendarCtrl, CalendarDateAttr)
 import wx.xrc
 from wx.html import HtmlEasyPrinting
 from .version import __version__
-from .entries import (TKEntries, TKEntry)
-from .parser import (TKDataVersionException, parse_data, unparse_data)
+from .entries import (TKEntries, TKEntry, TKEntryKey)
+from .parser import (CHANGELOG_COMPACT_SIZE, COMPRESSION_EXTENSIONS,
+                     DATAFILE_EXTENSIONS, FSYNC_DATA,
+                     TKDataVersionException, TKParseCancelledException,
+                     log_changes, parse_data, read_changelog)
+from .saver import TKSaveScheduler
 
 
 month_names = ['January', 'February', 'March', 'April',
@@ -36,6 +42,10 @@ class TKOptions:
        data_file:  path of the journal file to use (string)
        position:   location of the top-left window corner (wx.Point)
        size:       size of the window (wx.Size)
+       save_delay: milliseconds to wait for further changes before
+                   writing out a save of the journal file (int)
+       save_fsync: fsync policy used when writing the journal file
+                   (string; see unparse_data())
     """
     CONF_GROUP = 'options'
     CONF_FONT_NAME = CONF_GROUP + '/font-face'
@@ -43,6 +53,8 @@ class TKOptions:
     CONF_DATA_FILE = CONF_GROUP + '/data-file'
     CONF_POSITION = CONF_GROUP + '/window-position'
     CONF_SIZE = CONF_GROUP + '/window-size'
+    CONF_SAVE_DELAY = CONF_GROUP + '/save-delay'
+    CONF_SAVE_FSYNC = CONF_GROUP + '/save-fsync'
 
     def __init__(self):
         """Initialize the object, and set default values for
@@ -56,6 +68,8 @@ class TKOptions:
         self.data_file = None
         self.position = None
         self.size = wx.Size(600, 400)
+        self.save_delay = 2000
+        self.save_fsync = FSYNC_DATA
 
     def Read(self):
         """(Re-)read the stored configuration, applying settings atop
@@ -72,6 +86,8 @@ class TKOptions:
         if conf.Exists(self.CONF_SIZE):
             size = conf.Read(self.CONF_SIZE).split(',')
             self.size = wx.Size(int(size[0]), int(size[1]))
+        self.save_delay = conf.ReadInt(self.CONF_SAVE_DELAY, self.save_delay)
+        self.save_fsync = conf.Read(self.CONF_SAVE_FSYNC, self.save_fsync)
 
     def Write(self):
         """Store configuration values using whatever persistant
@@ -87,72 +103,35 @@ class TKOptions:
         if self.size:
             conf.Write(self.CONF_SIZE,
                        f'{self.size.GetWidth()},{self.size.GetHeight()}')
+        conf.WriteInt(self.CONF_SAVE_DELAY, self.save_delay)
+        conf.Write(self.CONF_SAVE_FSYNC, self.save_fsync)
         conf.Flush()
 
 
-class TKEntryTag:
-    """ThotKeeper Entry tag name."""
-
-    def __init__(self, name):
-        self.name = (name or '').strip('/')
-        self.name_len = len(self.name)
-
-    def __eq__(self, other):
-        return self.name == other.name
-
-    def __gt__(self, other):
-        # Tag names look like multi-component paths and sort
-        # similarly, where children are "greater" than their parents,
-        # but less than greater siblings of their parents.  So this
-        # algorithm is adapted from Apache Subversion's
-        # svn_path_compare_paths() function.
-
-        # Skip past the common prefix of both names.
-        min_len = min(self.name_len, other.name_len)
-        i = 0
-        while (i < min_len) and (self.name[i] == other.name[i]):
-            i = i + 1
-
-        # Now compare the first non-common character in both names,
-        # treating '/' as a hierarchy separator.  If one doesn't have
-        # such a next character,
-        self_char = i < self.name_len and self.name[i] or '\0'
-        other_char = i < other.name_len and other.name[i] or '\0'
-        if self_char == '/' and i == other.name_len:
-            return False
-        if other_char == '/' and i == self.name_len:
-            return True
-        if self_char == '/' and i < self.name_len:
-            return True
-        if other_char == '/' and i < other.name_len:
-            return False
-        return self_char < other_char
-
-
-class TKEntryKey:
-    def __init__(self, year, month, day, id, tag=None):
-        self.year = year
-        self.month = month
-        self.day = day
-        self.id = id
-        self.tag = TKEntryTag(tag)
-
-    def __eq__(self, other):
-        return ([self.tag, self.year, self.month, self.day, self.id] ==
-                [other.tag, other.year, other.month, other.day, other.id])
-
-    def __lt__(self, other):
-        if self.year is not None and other.year is None:
-            return True
-        if self.year is None and other.year is not None:
-            return False
-        return ([self.tag, self.year, self.month, self.day, self.id] <
-                [other.tag, other.year, other.month, other.day, other.id])
+def _SortKey(data):
+    """Return a tuple which sorts sibling items' TKEntryKey DATA into
+    the order TKTreeCtrl.OnCompareItems() gives them:  tags first, by
+    name, then dated items, most recent first.  (Among siblings, the
+    hierarchical comparison of tag names reduces to a plain string
+    comparison, and the missing date parts are all the same.)"""
+    if data.year is None:
+        return (0, data.tag.name)
+    return (1, -data.year, -(data.month or 0), -(data.day or 0),
+            -(data.id or 0))
 
 
 class TKTreeCtrl(wx.TreeCtrl):
+    """Tree control whose items carry TKEntryKey data, and which keeps
+    a map of those keys to their items (which means that no two items
+    may carry equal keys).  Children are kept in the order given by
+    OnCompareItems() by inserting new items in place with
+    InsertSortedItem(), guided by a cached list of each parent's child
+    sort keys."""
+
     def __init__(self, parent, style):
         wx.TreeCtrl.__init__(self, parent=parent, style=style)
+        self.item_ids = {}    # TKEntryKey -> tree item id
+        self.child_keys = {}  # TKEntryKey -> [child _SortKey(), ...]
 
     def GetRootId(self):
         return self.root_id
@@ -178,7 +157,35 @@ class TKTreeCtrl(wx.TreeCtrl):
                 break
             self.Walker(callback, child_id)
 
-    def FindChild(self, item_id, data):
+    def AppendItem(self, parent_id, text, image=-1, selImage=-1,
+                   data=None):
+        """Add an item as the last child of PARENT_ID.  Callers must
+        append children in sorted order."""
+        item_id = wx.TreeCtrl.AppendItem(self, parent_id, text, image,
+                                         selImage, data)
+        self.item_ids[data] = item_id
+        parent_data = self.GetItemData(parent_id)
+        self.child_keys.setdefault(parent_data, []).append(_SortKey(data))
+        return item_id
+
+    def InsertSortedItem(self, parent_id, text, data):
+        """Add an item as a child of PARENT_ID, in its sorted position
+        (found by bisection), and return it."""
+        keys = self.child_keys.setdefault(self.GetItemData(parent_id), [])
+        sort_key = _SortKey(data)
+        pos = bisect_left(keys, sort_key)
+        item_id = wx.TreeCtrl.InsertItem(self, parent_id, pos, text, -1, -1,
+                                         data)
+        keys.insert(pos, sort_key)
+        self.item_ids[data] = item_id
+        return item_id
+
+    def SortChildren(self, item_id):
+        wx.TreeCtrl.SortChildren(self, item_id)
+        self._RebuildChildKeys(item_id)
+
+    def _RebuildChildKeys(self, item_id):
+        keys = []
         cookie = None
         while 1:
             if cookie:
@@ -187,10 +194,68 @@ class TKTreeCtrl(wx.TreeCtrl):
                 child_id, cookie = self.GetFirstChild(item_id)
             if not child_id.IsOk():
                 break
-            child_data = self.GetItemData(child_id)
-            if child_data == data:
-                return child_id
-        return None
+            keys.append(_SortKey(self.GetItemData(child_id)))
+        self.child_keys[self.GetItemData(item_id)] = keys
+
+    def Delete(self, item_id):
+        data = self.GetItemData(item_id)
+        parent_data = self.GetItemData(self.GetItemParent(item_id))
+        keys = self.child_keys.get(parent_data)
+        if keys:
+            sort_key = _SortKey(data)
+            pos = bisect_left(keys, sort_key)
+            if pos < len(keys) and keys[pos] == sort_key:
+                del keys[pos]
+        self._ForgetItems(item_id)
+        wx.TreeCtrl.Delete(self, item_id)
+
+    def DeleteChildren(self, item_id):
+        if item_id == self.GetRootItem():
+            self.item_ids.clear()
+            self.child_keys.clear()
+        else:
+            self.child_keys.pop(self.GetItemData(item_id), None)
+            cookie = None
+            while 1:
+                if cookie:
+                    child_id, cookie = self.GetNextChild(item_id, cookie)
+                else:
+                    child_id, cookie = self.GetFirstChild(item_id)
+                if not child_id.IsOk():
+                    break
+                self._ForgetItems(child_id)
+        wx.TreeCtrl.DeleteChildren(self, item_id)
+
+    def _ForgetItems(self, item_id):
+        """Drop ITEM_ID and its descendants from the item map."""
+        def _ForgetItem(child_id):
+            data = self.GetItemData(child_id)
+            self.item_ids.pop(data, None)
+            self.child_keys.pop(data, None)
+        self.Walker(_ForgetItem, item_id)
+
+    def RekeyItem(self, item_id, data):
+        """Replace the TKEntryKey of ITEM_ID with DATA.  The caller is
+        responsible for re-sorting the item's siblings (and updating
+        the child keys of its children) as necessary."""
+        old_data = self.GetItemData(item_id)
+        del self.item_ids[old_data]
+        self.SetItemData(item_id, data)
+        self.item_ids[data] = item_id
+        keys = self.child_keys.pop(old_data, None)
+        if keys is not None:
+            self.child_keys[data] = keys
+
+    def FindItem(self, data):
+        """Return the item whose key equals DATA, or None if there is
+        no such item."""
+        return self.item_ids.get(data)
+
+    def FindChild(self, item_id, data):
+        child_id = self.item_ids.get(data)
+        if child_id is None or self.GetItemParent(child_id) != item_id:
+            return None
+        return child_id
 
     def Prune(self, item_id):
         while 1:
@@ -215,10 +280,86 @@ class TKTreeCtrl(wx.TreeCtrl):
 
 
 class TKEventTree(TKTreeCtrl):
+    """Event Tree (ordered by date).  Only the year items are created
+    up front; the items beneath a year or month are created from the
+    TKEntries object the first time it is expanded."""
+
     def __init__(self, parent, style):
         TKTreeCtrl.__init__(self, parent, style)
         root_data = TKEntryKey(None, None, None, None)
         self.root_id = self.AddRoot('ThotKeeper Entries', -1, -1, root_data)
+        self.entries = None
+        self.populated = set()  # (year, month) of populated items
+        self.Bind(wx.EVT_TREE_ITEM_EXPANDING, self._ItemExpanding)
+
+    def SetEntries(self, entries):
+        """(Re)build the tree to reflect the contents of ENTRIES."""
+        self.entries = entries
+        self.PruneAll()
+        # (Items are ordered most recent first; see OnCompareItems().)
+        for year in reversed(entries.get_years()):
+            data = TKEntryKey(year, None, None, None)
+            item_id = self.AppendItem(self.root_id, str(year), -1, -1, data)
+            self.SetItemHasChildren(item_id, True)
+
+    def PruneAll(self):
+        TKTreeCtrl.PruneAll(self)
+        self.populated.clear()
+
+    def Delete(self, item_id):
+        data = self.GetItemData(item_id)
+        if data is not None and data.day is None:
+            self.populated.discard((data.year, data.month))
+            if data.month is None:
+                # Deleting a year item deletes its month items, too.
+                for month in range(1, 13):
+                    self.populated.discard((data.year, month))
+        TKTreeCtrl.Delete(self, item_id)
+
+    def Expand(self, item_id):
+        self.PopulateItem(item_id)
+        TKTreeCtrl.Expand(self, item_id)
+
+    def _ItemExpanding(self, event):
+        self.PopulateItem(event.GetItem())
+        event.Skip()
+
+    def PopulateItem(self, item_id):
+        """Create the child items of the year or month item ITEM_ID,
+        if that hasn't already been done."""
+        data = self.GetItemData(item_id)
+        if self.entries is None or data is None or data.year is None \
+           or data.day is not None:
+            return
+        year, month = data.year, data.month
+        if (year, month) in self.populated:
+            return
+        self.populated.add((year, month))
+        if month is None:
+            for month in reversed(self.entries.get_months(year)):
+                data = TKEntryKey(year, month, None, None)
+                child_id = self.AppendItem(item_id, month_names[month - 1],
+                                           -1, -1, data)
+                self.SetItemHasChildren(child_id, True)
+            return
+        for day in reversed(self.entries.get_days(year, month)):
+            for id in reversed(self.entries.get_ids(year, month, day)):
+                entry = self.entries.get_entry(year, month, day, id)
+                data = TKEntryKey(year, month, day, id)
+                self.AppendItem(item_id,
+                                self._ItemLabel(day, entry.get_subject()),
+                                -1, -1, data)
+
+    def ExpandDate(self, year, month, day=None, id=None):
+        """Expand (populating as necessary) the items leading to that
+        for the given date, and return its date stack."""
+        stack = self.GetDateStack(year, month, day, id)
+        for depth in range(3):
+            if not stack[depth]:
+                break
+            self.Expand(stack[depth])
+            stack = self.GetDateStack(year, month, day, id)
+        return stack
 
     def GetDateStack(self, year, month, day, id):
         stack = []
@@ -245,45 +386,73 @@ class TKEventTree(TKTreeCtrl):
     def _ItemLabel(self, day, subject):
         return "%02d%s" % (int(day), subject and " - " + subject or '')
 
+    def _ApplyEntryChange(self, entry, year, month, day, id):
+        """Add, update, or (if ENTRY is None) remove the item for the
+        entry keyed on YEAR, MONTH, DAY, and ID, returning the item's
+        date stack."""
+        stack = self.GetDateStack(year, month, day, id)
+        if not entry:
+            if stack[3]:
+                self.Prune(stack[3])
+            # Unpopulated year and month items have no children to
+            # prune, so check whether they still have any entries.
+            stack = self.GetDateStack(year, month, day, id)
+            if stack[1] and year not in self.entries.get_years():
+                self.Prune(stack[1])
+            elif stack[2] and month not in self.entries.get_months(year):
+                self.Prune(stack[2])
+            return stack
+
+        # Only touch the items which already exist (or, for new years,
+        # the year item); the rest are created when their parent is
+        # first expanded.
+        subject = entry.get_subject()
+        if not stack[1]:
+            data = TKEntryKey(year, None, None, None)
+            stack[1] = self.InsertSortedItem(stack[0], str(year), data)
+            self.SetItemHasChildren(stack[1], True)
+        if (year, None) not in self.populated:
+            return stack
+        if not stack[2]:
+            data = TKEntryKey(year, month, None, None)
+            stack[2] = self.InsertSortedItem(stack[1],
+                                             month_names[month - 1], data)
+            self.SetItemHasChildren(stack[2], True)
+        if (year, month) not in self.populated:
+            return stack
+        if not stack[3]:
+            data = TKEntryKey(year, month, day, id)
+            stack[3] = self.InsertSortedItem(stack[2],
+                                             self._ItemLabel(day, subject),
+                                             data)
+        else:
+            self.SetItemText(stack[3], self._ItemLabel(day, subject))
+        return stack
+
     def EntryChangedListener(self, entry, year, month, day, id, expand=True):
         """Callback for TKEntries.store_entry()."""
         wx.BeginBusyCursor()
         try:
-            stack = self.GetDateStack(year, month, day, id)
-            if not entry:
-                if stack[3]:
-                    self.Prune(stack[3])
-            else:
-                subject = entry.get_subject()
-                if not stack[1]:
-                    data = TKEntryKey(year, None, None, None)
-                    stack[1] = self.AppendItem(stack[0],
-                                               str(year),
-                                               -1, -1, data)
-                    self.SortChildren(stack[0])
-                if not stack[2]:
-                    data = TKEntryKey(year, month, None, None)
-                    stack[2] = self.AppendItem(stack[1],
-                                               month_names[month - 1],
-                                               -1, -1, data)
-                    self.SortChildren(stack[1])
-                if not stack[3]:
-                    data = TKEntryKey(year, month, day, id)
-                    stack[3] = self.AppendItem(stack[2],
-                                               self._ItemLabel(day, subject),
-                                               -1, -1, data)
-                    self.SortChildren(stack[2])
-                else:
-                    self.SetItemText(stack[3], self._ItemLabel(day, subject))
+            stack = self._ApplyEntryChange(entry, year, month, day, id)
+            if entry:
                 if expand:
-                    self.Expand(stack[0])
-                    self.Expand(stack[1])
-                    self.Expand(stack[2])
-                    self.Expand(stack[3])
-                self.SelectItem(stack[3])
+                    stack = self.ExpandDate(year, month, day, id)
+                if stack[3]:
+                    self.SelectItem(stack[3])
         finally:
             wx.EndBusyCursor()
 
+    def EntryChangeSetListener(self, changeset):
+        """Callback for the TKChangeSet of a TKEntries.batch()."""
+        wx.BeginBusyCursor()
+        self.Freeze()
+        try:
+            for args in changeset.get_entry_changes():
+                self._ApplyEntryChange(*args)
+        finally:
+            self.Thaw()
+            wx.EndBusyCursor()
+
 
 class TKEventTagTree(TKTreeCtrl):
     """Event Tree (ordered by tags)"""
@@ -321,53 +490,148 @@ class TKEventTagTree(TKTreeCtrl):
             stack.append(item_id)  # depth=-1
         return stack
 
+    def SetEntries(self, entries):
+        """(Re)build the tree to reflect the contents of ENTRIES, in a
+        single pass over its tags, adding items in sorted order."""
+        self.Freeze()
+        try:
+            self.PruneAll()
+            # Create the tag items first, so that each tag's entries
+            # follow its subtags ...
+            tag_ids = []
+            for tag, entry_keys in entries.tag_trie.iter_sorted():
+                parent, sep, name = tag.rpartition('/')
+                parent_id = sep and self.FindItem(
+                    TKEntryKey(None, None, None, None, parent)) \
+                    or self.root_id
+                data = TKEntryKey(None, None, None, None, tag)
+                item_id = self.AppendItem(parent_id, name, -1, -1, data)
+                if entry_keys:
+                    tag_ids.append((tag, item_id, entry_keys))
+
+            # ... and then the entries, most recent first.
+            for tag, item_id, entry_keys in tag_ids:
+                for year, month, day, id in sorted(entry_keys, reverse=True):
+                    entry = entries.get_entry(year, month, day, id)
+                    self.AppendItem(item_id,
+                                    self._ItemLabel(day, month, year,
+                                                    entry.get_subject()),
+                                    -1, -1,
+                                    TKEntryKey(year, month, day, id, tag))
+        finally:
+            self.Thaw()
+
+    def FindTagItem(self, tag):
+        """Return the tree item id for TAG, or None if there is no
+        such item."""
+        item_id = self.GetRootItem()
+        tag_path = tag.split('/')
+        for i in range(len(tag_path)):
+            item_id = self.FindChild(item_id,
+                                     TKEntryKey(None, None, None, None,
+                                                '/'.join(tag_path[:i + 1])))
+            if item_id is None:
+                return None
+        return item_id
+
     def _ItemLabel(self, day, month, year, subject):
         return "%02d %s %4d%s" \
                % (int(day), month_abbrs[int(month) - 1], int(year),
                   subject and " - " + subject or '')
 
-    def EntryChangedListener(self, tag, entry, add=True):
-        """Callback for TKEntries.store_entry()."""
+    def _ApplyTagChange(self, tag, entry, add):
+        """Add, update, or (if ADD is not set) remove the item for
+        ENTRY beneath TAG."""
         year, month, day = entry.get_date()
         id = entry.get_id()
+        stack = self.GetTagStack(tag, year, month, day, id)
+        tag_path = list(map(str, tag.split('/')))
+        expected_stack_len = len(tag_path) + 2  # root + tag pieces + entry
+        if not add:
+            if len(stack) == expected_stack_len:
+                self.Prune(stack[-1])
+            return
+        newtag = None
+        for i in range(len(tag_path)):
+            if i == 0:
+                newtag = tag_path[i]
+            else:
+                newtag = newtag + '/' + tag_path[i]
+            if len(stack) == i + 1:
+                data = TKEntryKey(None, None, None, None, newtag)
+                stack.append(self.InsertSortedItem(stack[i], tag_path[i],
+                                                   data))
+        subject = entry.get_subject()
+        if len(stack) == i + 2:
+            data = TKEntryKey(year, month, day, id, newtag)
+            stack.append(self.InsertSortedItem(stack[i + 1],
+                                               self._ItemLabel(day, month,
+                                                               year,
+                                                               subject),
+                                               data))
+        else:
+            self.SetItemText(stack[i + 2],
+                             self._ItemLabel(day, month, year, subject))
+
+    def EntryChangedListener(self, tag, entry, add=True):
+        """Callback for TKEntries.store_entry()."""
         wx.BeginBusyCursor()
         try:
-            stack = self.GetTagStack(tag, year, month, day, id)
-            tag_path = list(map(str, tag.split('/')))
-            expected_stack_len = len(tag_path) + 2  # root + tag pieces + entry
-            if not add:
-                if len(stack) == expected_stack_len:
-                    self.Prune(stack[-1])
-            else:
-                newtag = None
-                for i in range(len(tag_path)):
-                    if i == 0:
-                        newtag = tag_path[i]
-                    else:
-                        newtag = newtag + '/' + tag_path[i]
-                    if len(stack) == i + 1:
-                        data = TKEntryKey(None, None, None, None, newtag)
-                        stack.append(self.AppendItem(stack[i], tag_path[i],
-                                                     -1, -1, data))
-                        self.SortChildren(stack[i])
-                subject = entry.get_subject()
-                if len(stack) == i + 2:
-                    data = TKEntryKey(year, month, day, id, newtag)
-                    stack.append(self.AppendItem(stack[i + 1],
-                                                 self._ItemLabel(day, month,
-                                                                 year,
-                                                                 subject),
-                                                 -1, -1, data))
-                    self.SortChildren(stack[i + 1])
-                else:
-                    self.SetItemText(stack[i + 2],
-                                     self._ItemLabel(day, month, year,
-                                                     subject))
+            self._ApplyTagChange(tag, entry, add)
+        finally:
+            wx.EndBusyCursor()
+
+    def EntryChangeSetListener(self, changeset):
+        """Callback for the TKChangeSet of a TKEntries.batch()."""
+        wx.BeginBusyCursor()
+        self.Freeze()
+        try:
+            for args in changeset.get_tag_changes():
+                self._ApplyTagChange(*args)
         finally:
+            self.Thaw()
+            wx.EndBusyCursor()
+
+    def TagRenamedListener(self, old, new, renamed):
+        """Callback for TKEntries.rename_tag()."""
+        wx.BeginBusyCursor()
+        self.Freeze()
+        try:
+            item_id = self.FindTagItem(old)
+            if item_id is not None \
+               and old.rpartition('/')[0] == new.rpartition('/')[0] \
+               and self.FindTagItem(new) is None:
+                # The tag keeps its place in the hierarchy, and doesn't
+                # collide with an existing tag, so we need only relabel
+                # its item and re-key the items beneath it.
+                def _RetagItem(child_id):
+                    data = self.GetItemData(child_id)
+                    self.RekeyItem(child_id,
+                                   TKEntryKey(data.year, data.month,
+                                              data.day, data.id,
+                                              new + data.tag.name[len(old):]))
+                self.Walker(_RetagItem, item_id)
+                self.Walker(self._RebuildChildKeys, item_id)
+                self.SetItemText(item_id, new.rpartition('/')[2])
+                self.SortChildren(self.GetItemParent(item_id))
+                return
+
+            # Otherwise, move each renamed entry's item to its new tag.
+            for old_tag, new_tag, entry in renamed:
+                self._ApplyTagChange(old_tag, entry, False)
+            for old_tag, new_tag, entry in renamed:
+                self._ApplyTagChange(new_tag, entry, True)
+        finally:
+            self.Thaw()
             wx.EndBusyCursor()
 
 
 class TKEventCal(GenericCalendarCtrl):
+    def __init__(self, *args, **kwargs):
+        GenericCalendarCtrl.__init__(self, *args, **kwargs)
+        self.entries = None
+        self.day_mask = 0  # highlighted days (bit 1 << DAY set for each)
+
     def SetDayAttr(self, day, has_event):
         if has_event:
             attr = CalendarDateAttr()
@@ -376,28 +640,28 @@ class TKEventCal(GenericCalendarCtrl):
         else:
             self.ResetAttr(day)
 
-    def HighlightEvents(self, entries):
-        date = self.GetDate()
-        year = date.GetYear()
-        month = date.GetMonth() + 1
-        has_events = 0
-        days = []
-        years = entries.get_years()
-        if year in years:
-            months = entries.get_months(year)
-            if month in months:
-                has_events = 1
-                days = entries.get_days(year, month)
-        wx.BeginBusyCursor()
-        try:
-            for day in range(1, 32):
-                if day in days and has_events:
-                    self.SetDayAttr(day, True)
-                else:
-                    self.SetDayAttr(day, False)
-            self.Refresh(True)
-        finally:
-            wx.EndBusyCursor()
+    def SetDayMask(self, mask):
+        """Highlight the days whose bits (1 << DAY) are set in MASK,
+        touching only the days whose highlighting actually changes."""
+        changed = mask ^ self.day_mask
+        if not changed:
+            return
+        self.day_mask = mask
+        while changed:
+            bit = changed & -changed
+            changed ^= bit
+            self.SetDayAttr(bit.bit_length() - 1, mask & bit)
+        self.Refresh(True)
+
+    def HighlightEvents(self, entries, date=None):
+        """Highlight the days of the displayed month (or that of the
+        wx.DateTime DATE) which have entries in ENTRIES, which later
+        change notifications are expected to concern."""
+        self.entries = entries
+        if date is None:
+            date = self.GetDate()
+        self.SetDayMask(entries.get_day_mask(date.GetYear(),
+                                             date.GetMonth() + 1))
 
     def EntryChangedListener(self, entry, year, month, day, id):
         """Callback for TKEntries.store_entry()."""
@@ -406,14 +670,11 @@ class TKEventCal(GenericCalendarCtrl):
             return
         if (date.GetMonth() + 1) != month:
             return
-        wx.BeginBusyCursor()
-        try:
-            if entry:
-                self.SetDayAttr(day, True)
-            else:
-                self.SetDayAttr(day, False)
-        finally:
-            wx.EndBusyCursor()
+        self.SetDayMask(self.entries.get_day_mask(year, month))
+
+    def EntryChangeSetListener(self, changeset):
+        """Callback for the TKChangeSet of a TKEntries.batch()."""
+        self.HighlightEvents(changeset.entries)
 
 
 class TKEntryPrinter(HtmlEasyPrinting):
@@ -461,6 +722,10 @@ class ThotKeeper(wx.App):
         self.conf = TKOptions()
         self.conf.Read()
 
+        # Datafile saves are written in the background.
+        self.saver = TKSaveScheduler(self.conf.save_delay / 1000.0,
+                                     self._SaveDone, self.conf.save_fsync)
+
         # Get the XML Resource class.
         resource_path = os.path.join(os.path.dirname(__file__),
                                      'resources.xrc')
@@ -514,6 +779,14 @@ class ThotKeeper(wx.App):
         # Construct our datafile parser and placeholder for data.
         self.entries = None
 
+        # We are not currently loading a datafile.  (While we are,
+        # this is the threading.Event used to cancel the load, the
+        # latest entry date parsed so far, and the set of days with
+        # changes in the change log.)
+        self.load_cancel = None
+        self.load_latest = None
+        self.load_changed_days = set()
+
         # Setup a printer object.
         self.printer = TKEntryPrinter()
 
@@ -700,6 +973,8 @@ class ThotKeeper(wx.App):
         return True
 
     def OnExit(self):
+        self._CancelLoad()
+        self.saver.flush()
         self.conf.Write()
         return wx.App.OnExit(self)
 
@@ -725,14 +1000,20 @@ class ThotKeeper(wx.App):
             wx.EndBusyCursor()
 
     def _SetDataFile(self, datafile, create=False):
-        """Set the active datafile, possible creating one on disk."""
+        """Set the active datafile, possible creating one on disk.
+        The datafile is loaded in the background; see _LoadDataFile()."""
         wx.Yield()
         wx.BeginBusyCursor()
         try:
+            self._CancelLoad()
+            # Don't load (or clobber) a datafile which has yet to be
+            # written out.
+            self.saver.flush()
             self.tree.PruneAll()
             self.tag_tree.PruneAll()
             self._SetEntryModified(False)
             self._SetDiaryModified(False)
+            self._SetEntryFormEditable(True)
             self.panel.Show(False)
             self.conf.data_file = datafile
             if datafile:
@@ -747,61 +1028,198 @@ class ThotKeeper(wx.App):
                     if os.path.exists(datafile):
                         os.remove(datafile)
                     self._SaveData(datafile, None)
-                self.frame.SetStatusText('Loading %s...' % datafile)
-                try:
-                    self.entries = parse_data(datafile)
-                except TKDataVersionException:
-                    wx.MessageBox((f'Datafile format used by "{datafile}" is '
-                                   f'not supported.'),
-                                  'Datafile Version Error',
-                                  wx.OK | wx.ICON_ERROR,
-                                  self.frame)
-                    return
-                finally:
-                    self.frame.SetStatusText('')
-                timestruct = time.localtime()
-
-                def _AddEntryToTree(entry):
-                    year, month, day = entry.get_date()
-                    id = entry.get_id()
-                    self.tree.EntryChangedListener(entry, year, month,
-                                                   day, id, False)
-                self.entries.enumerate_entries(_AddEntryToTree)
-
-                def _AddEntryToTagTree(entry, tag):
-                    self.tag_tree.EntryChangedListener(tag, entry, True)
-                self.entries.enumerate_tag_entries(_AddEntryToTagTree)
-
-                self.tag_tree.CollapseTree()
-                self.tree.CollapseTree()
-                stack = [_f for _f in self.tree.GetDateStack(timestruct[0],
-                                                             timestruct[1],
-                                                             timestruct[2],
-                                                             None) if _f]
-                for item in stack:
-                    self.tree.Expand(item)
-                self.entries.register_listener(self.tree.EntryChangedListener)
-                self.entries.register_listener(self.cal.EntryChangedListener)
-                self.entries.register_tag_listener(
-                    self.tag_tree.EntryChangedListener)
-                self._SetEntryFormDate(timestruct[0],
-                                       timestruct[1],
-                                       timestruct[2])
-                self.cal.HighlightEvents(self.entries)
-                self.panel.Show(True)
-                self._DiaryMenuEnable(True)
-                self.frame.Layout()
-                self._UpdateAuthorBox()
+                self._LoadDataFile(datafile, create)
             self.datafile = datafile
             self._SetTitle()
-            if create:
-                self._FileDiaryOptionsMenu(None)
         finally:
             wx.EndBusyCursor()
 
+    def _LoadDataFile(self, datafile, create=False):
+        """Begin loading DATAFILE on a worker thread.  Until the load
+        finishes, the views show a provisional TKEntries object which
+        fills in as entries are parsed, and the entry form is
+        read-only until its day has been loaded in full.  If CREATE is
+        set, offer the per-diary options dialog once the load is
+        complete."""
+        self.entries = TKEntries()
+        self._RegisterListeners()
+        self._PopulateTrees()
+        self.load_latest = None
+        # Changes replayed from the change log only show up once the
+        # load is complete, so days carrying them stay read-only 'til
+        # then.
+        self.load_changed_days = set([key[:3] for key
+                                      in read_changelog(datafile)])
+        timestruct = time.localtime()
+        self._SetEntryFormDate(timestruct[0], timestruct[1], timestruct[2])
+        self._SetEntryFormEditable(False)
+        # The per-diary options would be lost along with the
+        # provisional entries.
+        self._DiaryMenuEnable(False)
+        self.cal.HighlightEvents(self.entries)
+        self.panel.Show(True)
+        self.frame.Layout()
+        self._UpdateAuthorBox()
+        self.frame.SetStatusText('Loading %s...' % datafile)
+
+        cancel = threading.Event()
+        self.load_cancel = cancel
+        parsed = 0
+
+        def _Progress(bytes_read, bytes_total, new_entries):
+            nonlocal parsed
+            if cancel.is_set():
+                raise TKParseCancelledException()
+            parsed += len(new_entries)
+            wx.CallAfter(self._LoadProgress, cancel, datafile,
+                         bytes_read, bytes_total, parsed, new_entries)
+
+        def _Load():
+            try:
+                entries = parse_data(datafile, use_cache=True,
+                                     progress=_Progress)
+            except TKParseCancelledException:
+                return
+            except Exception as e:
+                wx.CallAfter(self._LoadFailed, cancel, datafile, e)
+                return
+            wx.CallAfter(self._LoadFinished, cancel, entries, create)
+
+        thread = threading.Thread(target=_Load, name='TKLoader')
+        thread.daemon = True
+        thread.start()
+
+    def _CancelLoad(self):
+        """Abandon the datafile load in progress, if any."""
+        if self.load_cancel is not None:
+            self.load_cancel.set()
+            self.load_cancel = None
+
+    def _LoadProgress(self, cancel, datafile, bytes_read, bytes_total,
+                      parsed, new_entries):
+        """Report on the progress of the datafile load identified by
+        CANCEL, and add NEW_ENTRIES to the provisional entries."""
+        if cancel is not self.load_cancel:
+            return
+        percent = bytes_total and (100 * bytes_read // bytes_total) or 100
+        self.frame.SetStatusText('Loading %s... %d%% (%d entries)'
+                                 % (datafile, percent, parsed))
+
+        # Once everything has been read, the load is all but done, and
+        # _LoadFinished() will rebuild the views from scratch anyway.
+        if bytes_read >= bytes_total:
+            return
+        with self.entries.batch():
+            for entry in new_entries:
+                self.entries.store_entry(entry)
+                if self.load_latest is None \
+                   or entry.get_date() > self.load_latest:
+                    self.load_latest = entry.get_date()
+
+        # Show the entry form's entry as soon as it turns up, and let it
+        # be edited once the rest of its day has, too.
+        year, month, day, id = self._GetEntryFormKeys()
+        if id is None and not self.entry_modified \
+           and self.entries.get_first_id(year, month, day) is not None:
+            self._SetEntryFormDate(year, month, day)
+        else:
+            self._SetEntryFormEditable(self._IsDayLoaded(year, month, day))
+
+    def _IsDayLoaded(self, year, month, day):
+        """Return True iff the entries for YEAR, MONTH, and DAY have
+        been loaded in full."""
+        if self.load_cancel is None:
+            return True
+        # Datafiles are written in date order, so a day is complete
+        # once a later one has turned up.
+        return (self.load_latest is not None and
+                (year, month, day) < self.load_latest and
+                (year, month, day) not in self.load_changed_days)
+
+    def _LoadFinished(self, cancel, entries, create):
+        """Install ENTRIES, the result of the datafile load identified
+        by CANCEL, in place of the provisional entries."""
+        if cancel is not self.load_cancel:
+            return
+        self.load_cancel = None
+        self.frame.SetStatusText('')
+        self.entries = entries
+        self._RegisterListeners()
+        self._PopulateTrees()
+        timestruct = time.localtime()
+        self.tree.ExpandDate(timestruct[0], timestruct[1])
+        self._SetEntryFormEditable(True)
+        # Edits made to the entry form during the load were to a day
+        # already loaded in full, so they remain good.
+        if not self.entry_modified:
+            year, month, day, id = self._GetEntryFormKeys()
+            if id is None or entries.get_entry(year, month, day, id) is None:
+                id = -1
+            self._SetEntryFormDate(year, month, day, id)
+        self.cal.HighlightEvents(self.entries)
+        self._DiaryMenuEnable(True)
+        self._UpdateAuthorBox()
+        if create:
+            self._FileDiaryOptionsMenu(None)
+
+    def _LoadFailed(self, cancel, datafile, error):
+        """Handle the failure, with ERROR, of the datafile load
+        identified by CANCEL."""
+        if cancel is not self.load_cancel:
+            return
+        self.load_cancel = None
+        self.frame.SetStatusText('')
+        self.tree.PruneAll()
+        self.tag_tree.PruneAll()
+        self._SetEntryFormEditable(True)
+        self.panel.Show(False)
+        self.datafile = None
+        self._SetTitle()
+        if not isinstance(error, TKDataVersionException):
+            raise error
+        wx.MessageBox((f'Datafile format used by "{datafile}" is '
+                       f'not supported.'),
+                      'Datafile Version Error',
+                      wx.OK | wx.ICON_ERROR,
+                      self.frame)
+
+    def _RefuseWhileLoading(self):
+        """If the active datafile is still being loaded, inform the
+        user and return True.  Otherwise, return False."""
+        if self.load_cancel is None:
+            return False
+        wx.MessageBox(('Diary is still loading.  Please try again once '
+                       'it has finished.'),
+                      'Diary Loading',
+                      wx.OK | wx.ICON_INFORMATION,
+                      self.frame)
+        return True
+
+    def _RegisterListeners(self):
+        """Register our views for change notifications from
+        self.entries."""
+        self.entries.register_listener(
+            self.tree.EntryChangedListener,
+            self.tree.EntryChangeSetListener)
+        self.entries.register_listener(
+            self.cal.EntryChangedListener,
+            self.cal.EntryChangeSetListener)
+        self.entries.register_tag_listener(
+            self.tag_tree.EntryChangedListener,
+            self.tag_tree.EntryChangeSetListener,
+            self.tag_tree.TagRenamedListener)
+
+    def _PopulateTrees(self):
+        """(Re)build the date and tag trees from scratch to reflect
+        the current set of entries."""
+        self.tree.SetEntries(self.entries)
+        self.tag_tree.SetEntries(self.entries)
+        self.tag_tree.CollapseTree()
+        self.tree.CollapseTree()
+
     def _SaveData(self, path, entries):
         try:
-            unparse_data(path, entries)
+            self.saver.save(path, entries)
         except Exception as e:
             wx.MessageBox(f'Error writing datafile:\n{e}',
                           'Write Error',
@@ -809,6 +1227,43 @@ class ThotKeeper(wx.App):
                           self.frame)
             raise
 
+    def _ScheduleSave(self):
+        """Arrange for the active datafile to be written out (in the
+        background) to reflect the current set of entries."""
+        self.saver.schedule(self.conf.data_file, self.entries)
+        self.frame.SetStatusText('Saving...', 1)
+
+    def _SaveDone(self, datafile, error):
+        """Callback for self.saver, called from its worker thread."""
+        wx.CallAfter(self._SaveFinished, datafile, error)
+
+    def _SaveFinished(self, datafile, error):
+        if not self.saver.is_pending():
+            self.frame.SetStatusText('', 1)
+        if error is None:
+            return
+        if datafile == self.conf.data_file:
+            self._SetDiaryModified(True)
+        wx.MessageBox(f'Error writing datafile:\n{error}',
+                      'Write Error',
+                      wx.OK | wx.ICON_ERROR,
+                      self.frame)
+
+    def _LogChanges(self, stored=(), removed=()):
+        """Record entry changes in the active datafile's change log,
+        compacting that log into the datafile itself once it grows
+        large enough.  STORED and REMOVED are as for log_changes()."""
+        try:
+            log_size = log_changes(self.conf.data_file, stored, removed)
+        except Exception as e:
+            wx.MessageBox(f'Error writing datafile change log:\n{e}',
+                          'Write Error',
+                          wx.OK | wx.ICON_ERROR,
+                          self.frame)
+            raise
+        if log_size > CHANGELOG_COMPACT_SIZE:
+            self._ScheduleSave()
+
     def _RefuseUnsavedModifications(self, refuse_modified_options=False):
         """If there exist unsaved entry modifications, inform the user
         and return True.  Otherwise, return False."""
@@ -890,6 +1345,8 @@ class ThotKeeper(wx.App):
         self.frame.FindWindowById(self.text_id).SetValue(text)
         self.frame.FindWindowById(self.tags_id).SetValue(tags)
         self._NotifyEntryLoaded(entry and True or False)
+        if self.load_cancel is not None:
+            self._SetEntryFormEditable(self._IsDayLoaded(year, month, day))
 
     def _NotifyEntryLoaded(self, is_loaded=True):
         self._ToggleEntryMenus(is_loaded)
@@ -916,6 +1373,11 @@ class ThotKeeper(wx.App):
         self.menubar.FindItemById(self.file_save_id).Enable(
             enable or self.entry_modified)
 
+    def _SetEntryFormEditable(self, enable=True):
+        for id in [self.author_id, self.subject_id, self.text_id,
+                   self.tags_id]:
+            self.frame.FindWindowById(id).SetEditable(enable)
+
     def _GetEntryFormKeys(self):
         # FIXME: This interface is ... hacky.
         return (self.entry_form_key.year,
@@ -938,14 +1400,19 @@ class ThotKeeper(wx.App):
             directory = os.environ['HOME']
         if self.conf.data_file is not None:
             directory = os.path.dirname(self.conf.data_file)
+        patterns = ';'.join(['*' + ext for ext in DATAFILE_EXTENSIONS])
         return wx.FileDialog(self.frame, title, directory, basename,
-                             'ThotKeeper journal files (*.tkj)|*.tkj',
+                             'ThotKeeper journal files (%s)|%s'
+                             % (patterns.replace(';', ', '), patterns),
                              flags)
 
     def _SaveEntriesToPath(self, path=None):
+        if self._RefuseWhileLoading():
+            return
         wx.Yield()
         wx.BeginBusyCursor()
         try:
+            stored = []
             if self.entry_modified:
                 year, month, day, author, subject, text, id, tags \
                     = self._GetEntryFormBits()
@@ -956,13 +1423,18 @@ class ThotKeeper(wx.App):
                     else:
                         id = id + 1
                     self.entry_form_key = TKEntryKey(year, month, day, id)
-                self.entries.store_entry(TKEntry(author, subject, text,
-                                                 year, month, day,
-                                                 id, tags))
-            if path is None:
-                path = self.conf.data_file
-            self._SaveData(path, self.entries)
-            if path != self.conf.data_file:
+                entry = TKEntry(author, subject, text, year, month, day,
+                                id, tags)
+                self.entries.store_entry(entry)
+                stored.append(entry)
+            if path is None or path == self.conf.data_file:
+                # Log the entry (so it's safely on disk right away),
+                # and leave the rewrite of the datafile to self.saver.
+                if stored:
+                    self._LogChanges(stored)
+                self._ScheduleSave()
+            else:
+                self._SaveData(path, self.entries)
                 self._SetDataFile(path, False)
             self._SetEntryModified(False)
             self._SetDiaryModified(False)
@@ -971,25 +1443,15 @@ class ThotKeeper(wx.App):
             wx.EndBusyCursor()
 
     def _RenameTag(self, tag):
+        if self._RefuseWhileLoading():
+            return
         rename_tag_box = self.rename_tag_dialog.FindWindowById(
             self.rename_tag_id)
         rename_tag_box.SetValue(tag)
         if self.rename_tag_dialog.ShowModal() == wx.ID_OK \
                 and rename_tag_box.GetValue() != tag:
             self._SetDiaryModified(True)
-
-            def _UpdateSingleTag(current):
-                if current == tag:
-                    return rename_tag_box.GetValue()
-                if current.startswith(tag + '/'):
-                    return current.replace(tag, rename_tag_box.GetValue(), 1)
-                return current
-            for en in self.entries.get_entries_by_partial_tag(tag):
-                updatedtags = list(map(_UpdateSingleTag, en.get_tags()))
-                self.entries.store_entry(TKEntry(en.author, en.subject,
-                                                 en.text, en.year,
-                                                 en.month, en.day,
-                                                 en.id, updatedtags))
+            self.entries.rename_tag(tag, rename_tag_box.GetValue())
 
     def _QueryChooseDate(self, title, default_date=None):
         # Fetch the date selection dialog, and replace the "unknown" XRC
@@ -1043,6 +1505,8 @@ class ThotKeeper(wx.App):
         return date
 
     def _RedateEntry(self, year, month, day, id):
+        if self._RefuseWhileLoading():
+            return False
         if self._RefuseUnsavedModifications(True):
             return False
         entry = self.entries.get_entry(year, month, day, id)
@@ -1062,19 +1526,28 @@ class ThotKeeper(wx.App):
                 new_id = 1
             else:
                 new_id = new_id + 1
-            self.entries.store_entry(TKEntry(entry.get_author(),
-                                             entry.get_subject(),
-                                             entry.get_text(),
-                                             new_year,
-                                             new_month,
-                                             new_day,
-                                             new_id,
-                                             entry.get_tags()))
-            self.entries.remove_entry(year, month, day, id)
-            self._SaveData(self.conf.data_file, self.entries)
+            new_entry = TKEntry(entry.get_author(),
+                                entry.get_subject(),
+                                entry.get_text(),
+                                new_year,
+                                new_month,
+                                new_day,
+                                new_id,
+                                entry.get_tags())
+            with self.entries.batch():
+                self.entries.store_entry(new_entry)
+                self.entries.remove_entry(year, month, day, id)
+            # Unlike an unbatched store, the batch's change set doesn't
+            # reveal the entry in the date tree, so do that here.
+            stack = self.tree.ExpandDate(new_year, new_month, new_day, new_id)
+            if stack[3]:
+                self.tree.SelectItem(stack[3])
+            self._LogChanges([new_entry], [(year, month, day, id)])
             self._SetEntryFormDate(new_year, new_month, new_day, new_id)
 
     def _DuplicateEntry(self, year, month, day, id):
+        if self._RefuseWhileLoading():
+            return False
         if self._RefuseUnsavedModifications(True):
             return False
         new_id = self.entries.get_last_id(year, month, day)
@@ -1083,18 +1556,21 @@ class ThotKeeper(wx.App):
         else:
             new_id = new_id + 1
         entry = self.entries.get_entry(year, month, day, id)
-        self.entries.store_entry(TKEntry(entry.get_author(),
-                                         entry.get_subject(),
-                                         entry.get_text(),
-                                         year,
-                                         month,
-                                         day,
-                                         new_id,
-                                         entry.get_tags()))
-        self._SaveData(self.conf.data_file, self.entries)
+        new_entry = TKEntry(entry.get_author(),
+                            entry.get_subject(),
+                            entry.get_text(),
+                            year,
+                            month,
+                            day,
+                            new_id,
+                            entry.get_tags())
+        self.entries.store_entry(new_entry)
+        self._LogChanges([new_entry])
         self._SetEntryFormDate(year, month, day, new_id)
 
     def _DeleteEntry(self, year, month, day, id, skip_verify=False):
+        if self._RefuseWhileLoading():
+            return False
         if self._RefuseUnsavedModifications(True):
             return False
         entry = self.entries.get_entry(year, month, day, id)
@@ -1114,7 +1590,7 @@ class ThotKeeper(wx.App):
                 self.frame)
         if skip_verify or wx.OK == _ConfirmDelete():
             self.entries.remove_entry(year, month, day, id)
-            self._SaveData(self.conf.data_file, self.entries)
+            self._LogChanges(removed=[(year, month, day, id)])
             dispyear, dispmonth, dispday, dispid = self._GetEntryFormKeys()
             if [dispyear, dispmonth, dispday, dispid] == \
                [year, month, day, id]:
@@ -1141,28 +1617,26 @@ class ThotKeeper(wx.App):
         if self._RefuseUnsavedModifications(True):
             return False
 
-        # First, clone the entries older than YEAR/MONTH/DAY.
-        new_entries = TKEntries()
-
-        def _CloneEntryCB(entry):
-            entry_year, entry_month, entry_day = entry.get_date()
-            if ((entry_year < year) or
-                (entry_year == year and entry_month < month) or
-                ([entry_year, entry_month] == [year, month] and
-                 entry_day < day)):
-                new_entries.store_entry(entry)
-        self.entries.enumerate_entries(_CloneEntryCB)
-
-        # Now write those suckers to a new place.
-        self._SaveData(archive_path, new_entries)
-
-        # Finally, delete the old entries from the current set.
-        def _DeleteEntryCB(entry):
-            entry_year, entry_month, entry_day = entry.get_date()
-            entry_id = entry.get_id()
-            self._DeleteEntry(entry_year, entry_month, entry_day, entry_id,
-                              skip_verify=True)
-        new_entries.enumerate_entries(_DeleteEntryCB)
+        # First, split off the entries older than YEAR/MONTH/DAY ...
+        new_entries = self.entries.split(year, month, day)
+
+        # ... and write those suckers to a new place.  If we can't,
+        # put them back where we found them.
+        try:
+            self._SaveData(archive_path, new_entries)
+        except Exception:
+            self.entries.merge(new_entries)
+            raise
+
+        # Now save what remains, and refresh our views to match.
+        self._SaveData(self.conf.data_file, self.entries)
+        self._SetDiaryModified(False)
+        self._PopulateTrees()
+        self.cal.HighlightEvents(self.entries)
+        year, month, day, id = self._GetEntryFormKeys()
+        if id is not None and \
+           self.entries.get_entry(year, month, day, id) is None:
+            self._SetEntryFormDate(year, month, day)
 
     # -----------------------------------------------------------------
     # Tree Popup Menu Actions
@@ -1260,7 +1734,7 @@ class ThotKeeper(wx.App):
                                      wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
         if dialog.ShowModal() == wx.ID_OK:
             path = dialog.GetPath()
-            if len(path) < 5 or not path.endswith('.tkj'):
+            if len(path) < 5 or not path.endswith(DATAFILE_EXTENSIONS):
                 path = path + '.tkj'
             self._SetDataFile(path, True)
         dialog.Destroy()
@@ -1283,12 +1757,14 @@ class ThotKeeper(wx.App):
                                      wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
         if dialog.ShowModal() == wx.ID_OK:
             path = dialog.GetPath()
-            if len(path) < 5 or not path.endswith('.tkj'):
+            if len(path) < 5 or not path.endswith(DATAFILE_EXTENSIONS):
                 path = path + '.tkj'
             self._SaveEntriesToPath(path)
         dialog.Destroy()
 
     def _FileArchiveMenu(self, event):
+        if self._RefuseWhileLoading():
+            return
         date = self._QueryChooseDate('Archive files before which date?')
         if date is None:
             return
@@ -1298,6 +1774,10 @@ class ThotKeeper(wx.App):
         if self.conf.data_file is not None:
             new_base, new_ext = os.path.splitext(os.path.basename(
                 self.conf.data_file))
+            # Archives are compressed like their originals.
+            if new_ext in COMPRESSION_EXTENSIONS:
+                new_base, base_ext = os.path.splitext(new_base)
+                new_ext = base_ext + new_ext
             if not new_ext:
                 new_ext = '.tkj'
             new_basename = new_base + '.archive' + new_ext
@@ -1310,7 +1790,7 @@ class ThotKeeper(wx.App):
         if path is None:
             return
 
-        if len(path) < 5 or not path.endswith('.tkj'):
+        if len(path) < 5 or not path.endswith(DATAFILE_EXTENSIONS):
             path = path + '.tkj'
         wx.Yield()
         wx.BeginBusyCursor()
@@ -1347,6 +1827,8 @@ class ThotKeeper(wx.App):
         self.frame.Close()
 
     def _FileDiaryOptionsMenu(self, event):
+        if self._RefuseWhileLoading():
+            return
         # Grab the controls
         author_name_box = self.frame.FindWindowById(self.author_name_id)
         author_global_radio = self.frame.FindWindowById(self.author_global_id)
@@ -1465,6 +1947,10 @@ class ThotKeeper(wx.App):
 
     def _FrameClosure(self, event):
         self.frame.SetStatusText("Quitting...")
+        # Finish any pending saves, giving their errors (if any) a
+        # chance to mark the diary as modified.
+        self.saver.flush()
+        wx.Yield()
         self.conf.size = self.frame.GetSize()
         self.conf.position = self.frame.GetPosition()
         if event.CanVeto() and self._RefuseUnsavedModifications(True):
@@ -1480,27 +1966,7 @@ class ThotKeeper(wx.App):
         self._SetEntryFormDate(year, month, day)
 
     def _CalendarDisplayChanged(self, event):
-        date = event.GetDate()
-        year = date.GetYear()
-        month = date.GetMonth() + 1
-        has_events = 0
-        days = []
-        years = self.entries.get_years()
-        if year in years:
-            months = self.entries.get_months(year)
-            if month in months:
-                has_events = 1
-                days = self.entries.get_days(year, month)
-        wx.BeginBusyCursor()
-        try:
-            for day in range(1, 32):
-                if day in days and has_events:
-                    self.cal.SetDayAttr(day, True)
-                else:
-                    self.cal.SetDayAttr(day, False)
-            self.cal.Refresh(True)
-        finally:
-            wx.EndBusyCursor()
+        self.cal.HighlightEvents(self.entries, event.GetDate())
 
     def _TodayButtonActivated(self, event):
         timestruct = time.localtime()
@@ -0,0 +1,138 @@
+# ThotKeeper -- a personal daily journal application.
+#
+# Copyright (c) 2004-2025 C. Michael Pilato.  All rights reserved.
+#
+# By using this file, you agree to the terms and conditions set forth in
+# the LICENSE file which can be found at the top level of the ThotKeeper
+# distribution.
+#
+# Website: https://github.com/cmpilato/thotkeeper
+
+"""Sidecar load cache for diary data files.
+
+Parsing a large diary's XML can take a while, so we can keep a compact
+binary snapshot of its entries in a sidecar file (named after the
+diary, with a '.cache' suffix) alongside it.  The snapshot records the
+size, modification time, and content hash of the diary file from
+which it was built, and is used only if all three still match.
+
+The cache file itself consists of a magic header, a SHA-1 digest of
+the payload, and the payload:  a marshalled pair of the diary
+signature and the (separately marshalled, so we needn't decode it
+until the signature checks out) snapshot of author settings and
+per-entry tuples.  Caches which are unreadable, truncated, corrupt,
+or otherwise unexpected are ignored."""
+
+import hashlib
+import marshal
+import os
+import threading
+from .entries import (TKEntries, TKEntry)
+
+CACHE_SUFFIX = '.cache'
+CACHE_MAGIC = b'TKCACHE1\n'
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def get_cache_path(datafile):
+    """Return the path of the load cache for DATAFILE."""
+    return datafile + CACHE_SUFFIX
+
+
+def get_signature(datafile):
+    """Return a (size, mtime, content hash) tuple which identifies the
+    current state of DATAFILE."""
+    st = os.stat(datafile)
+    digest = hashlib.sha1()
+    with open(datafile, 'rb') as fp:
+        while True:
+            block = fp.read(_HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    return (st.st_size, st.st_mtime_ns, digest.digest())
+
+
+def load_cache(datafile):
+    """Return a TKEntries object populated from the load cache for
+    DATAFILE, or None if there is no usable, up-to-date cache."""
+    try:
+        with open(get_cache_path(datafile), 'rb') as fp:
+            data = fp.read()
+        if not data.startswith(CACHE_MAGIC):
+            return None
+        header_len = len(CACHE_MAGIC) + hashlib.sha1().digest_size
+        payload = data[header_len:]
+        if hashlib.sha1(payload).digest() != data[len(CACHE_MAGIC):
+                                                  header_len]:
+            return None
+        signature, snapshot = marshal.loads(payload)
+
+        # Check the cheap parts of the signature before bothering to
+        # hash the datafile's contents (or to decode the snapshot).
+        st = os.stat(datafile)
+        if (st.st_size, st.st_mtime_ns) != tuple(signature[:2]):
+            return None
+        if get_signature(datafile) != tuple(signature):
+            return None
+
+        author_name, author_global, snapshot = marshal.loads(snapshot)
+        entries = TKEntries()
+        entries.set_author_name(author_name)
+        entries.set_author_global(author_global)
+        entries.load_entries([TKEntry(*item) for item in snapshot])
+        return entries
+    except Exception:
+        return None
+
+
+def _snapshot(entries):
+    snapshot = []
+
+    def _snapshot_entry(entry):
+        year, month, day = entry.get_date()
+        snapshot.append((entry.get_author(), entry.get_subject(),
+                         entry.get_text(), year, month, day,
+                         entry.get_id(), list(entry.get_tags())))
+    entries.enumerate_entries(_snapshot_entry)
+    return snapshot
+
+
+def _write_cache(cache_path, data):
+    tmp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp_path, cache_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def save_cache(datafile, entries, signature, background=False):
+    """Write a load cache for DATAFILE, whose parsed contents are
+    ENTRIES and whose state was SIGNATURE (as returned by
+    get_signature()) when parsed.  If BACKGROUND is set, the snapshot
+    of ENTRIES is taken immediately but encoded and written to disk in
+    a separate thread (which is returned); errors writing the cache
+    are ignored."""
+    signature = tuple(signature)
+    payload = (entries.get_author_name(), entries.get_author_global(),
+               _snapshot(entries))
+    cache_path = get_cache_path(datafile)
+
+    def _save():
+        try:
+            data = marshal.dumps((signature, marshal.dumps(payload)))
+            digest = hashlib.sha1(data).digest()
+            _write_cache(cache_path, CACHE_MAGIC + digest + data)
+        except Exception:
+            pass
+
+    if not background:
+        _save()
+        return None
+    thread = threading.Thread(target=_save, name='TKCacheWriter')
+    thread.start()
+    return thread
@@ -0,0 +1,294 @@
+# ThotKeeper -- a personal daily journal application.
+#
+# Copyright (c) 2004-2025 C. Michael Pilato.  All rights reserved.
+#
+# By using this file, you agree to the terms and conditions set forth in
+# the LICENSE file which can be found at the top level of the ThotKeeper
+# distribution.
+#
+# Website: https://github.com/cmpilato/thotkeeper
+
+"""Headless command-line access to ThotKeeper diary files.
+
+These subcommands work directly atop the diary data layer, and so must
+never import (even indirectly) the GUI, wx, or requests."""
+
+import json
+import sys
+from argparse import (SUPPRESS, ArgumentTypeError)
+from datetime import date
+from .entries import TKEntry
+from .parser import (CHANGELOG_COMPACT_SIZE, iter_entries, log_changes,
+                     parse_data, unparse_data)
+from .search import search_entries
+
+
+def parse_date(text):
+    """Parse TEXT, a YYYY-MM-DD date string, returning a date object."""
+    try:
+        year, month, day = [int(x) for x in text.split('-')]
+        return date(year, month, day)
+    except ValueError:
+        raise ValueError(f'Invalid date "{text}" (expected YYYY-MM-DD)')
+
+
+def _format_date(entry):
+    return '%04d-%02d-%02d' % entry.get_date()
+
+
+def _format_summary(entry):
+    line = '%s %-3d %s' % (_format_date(entry), entry.get_id(),
+                           entry.get_subject() or '(no subject)')
+    tags = entry.get_tags()
+    if tags:
+        line += ' [%s]' % (', '.join(tags))
+    return line
+
+
+def _format_entry(entry, author=None):
+    lines = ['%s (%d) %s' % (_format_date(entry), entry.get_id(),
+                             entry.get_subject() or '(no subject)')]
+    author = author or entry.get_author()
+    if author:
+        lines.append('Author: %s' % (author))
+    if entry.get_tags():
+        lines.append('Tags: %s' % (', '.join(entry.get_tags())))
+    lines.append('')
+    lines.append(entry.get_text())
+    return '\n'.join(lines)
+
+
+def _get_end(args):
+    # --to is inclusive, but the ranges we pass along aren't.
+    return args.end and date.fromordinal(args.end.toordinal() + 1) or None
+
+
+def _get_author(entries, entry):
+    if entries.get_author_global() or not entry.get_author():
+        return entries.get_author_name()
+    return entry.get_author()
+
+
+def _select_entries(entries, args):
+    """Return an iterator over the entries of ENTRIES dated within
+    the range ARGS.start to ARGS.end (inclusive) and carrying the tag
+    ARGS.tag (or one beneath it), in date order."""
+    selected = entries.iter_range(args.start, _get_end(args))
+    if args.tag:
+        tagged = set([id(entry) for entry
+                      in entries.get_entries_by_partial_tag(args.tag)])
+        selected = (entry for entry in selected if id(entry) in tagged)
+    return selected
+
+
+def _stream_entries(args):
+    """Like _select_entries(), but read the entries straight out of
+    ARGS.file (in file order) rather than loading the whole diary."""
+    return iter_entries(args.file, args.start, _get_end(args), args.tag)
+
+
+def _save_entry(datafile, entries, entry):
+    """Store ENTRY in ENTRIES, and record it in DATAFILE."""
+    entries.store_entry(entry)
+    if log_changes(datafile, [entry]) > CHANGELOG_COMPACT_SIZE:
+        unparse_data(datafile, entries)
+
+
+def cmd_list(entries, args):
+    """list entries, one per line"""
+    for entry in _select_entries(entries, args):
+        print(_format_summary(entry))
+
+
+def cmd_show(entries, args):
+    """show the entries for a given date"""
+    year, month, day = args.date.year, args.date.month, args.date.day
+    ids = [args.id]
+    if args.id is None:
+        try:
+            ids = entries.get_ids(year, month, day)
+        except KeyError:
+            ids = []
+    shown = [entries.get_entry(year, month, day, id) for id in ids]
+    shown = [entry for entry in shown if entry is not None]
+    if not shown:
+        which = args.date.isoformat()
+        if args.id is not None:
+            which += ' (%d)' % (args.id)
+        raise Exception(f'No entry found for {which}')
+    texts = [_format_entry(entry, _get_author(entries, entry))
+             for entry in shown]
+    print('\n\n'.join(texts))
+
+
+def cmd_add(entries, args):
+    """add a new entry"""
+    when = args.date or date.today()
+    text = args.text
+    if text is None or text == '-':
+        text = sys.stdin.read()
+    tags = []
+    for tag in args.tags:
+        tag = '/'.join([x.strip() for x in tag.lower().split('/')])
+        if tag:
+            tags.append(tag)
+    # (get_new_id() gives None for a day with no entries yet.)
+    id = (entries.get_last_id(when.year, when.month, when.day) or 0) + 1
+    _save_entry(args.file, entries,
+                TKEntry(args.author or '', args.subject or '', text,
+                        when.year, when.month, when.day, id, tags))
+    print('Added %s (%d)' % (when.isoformat(), id))
+
+
+def cmd_search(entries, args):
+    """search entries' subjects, texts, and tags"""
+    for year, month, day, id in search_entries(entries, args.query):
+        print(_format_summary(entries.get_entry(year, month, day, id)))
+
+
+def cmd_tags(entries, args):
+    """list the tags in use, with their entry counts"""
+    for tag in sorted(entries.get_tags()):
+        print('%6d %s' % (len(entries.get_entries_by_tag(tag)), tag))
+
+
+def cmd_stats(entries, args):
+    """show statistics about the diary"""
+    count = 0
+    days = set()
+    words = 0
+    years = {}
+    tags = set()
+    for entry in _stream_entries(args):
+        count += 1
+        days.add(entry.get_date())
+        words += len(entry.get_text().split())
+        years[entry.year] = years.get(entry.year, 0) + 1
+        tags.update(entry.get_tags())
+    print('Entries: %d' % (count))
+    print('Days with entries: %d' % (len(days)))
+    print('Words: %d' % (words))
+    if days:
+        print('First entry: %04d-%02d-%02d' % min(days))
+        print('Last entry: %04d-%02d-%02d' % max(days))
+    print('Tags: %d' % (len(tags)))
+    for year in sorted(years.keys()):
+        print('  %d: %d entries' % (year, years[year]))
+
+
+def cmd_export(entries, args):
+    """export entries as text or JSON"""
+    # Entries go out in file order (which is by date for files written
+    # by ThotKeeper itself), each as soon as it has been parsed.
+    selected = _stream_entries(args)
+    fp = sys.stdout
+    if args.output:
+        fp = open(args.output, 'w', encoding='utf-8')
+    try:
+        if args.format == 'json':
+            fp.write('[')
+            for i, entry in enumerate(selected):
+                fp.write((i and ',\n ' or '\n ') + json.dumps({
+                    'date': _format_date(entry),
+                    'id': entry.get_id(),
+                    'author': entry.get_author(),
+                    'subject': entry.get_subject(),
+                    'tags': list(entry.get_tags()),
+                    'text': entry.get_text(),
+                    }, ensure_ascii=False))
+            fp.write('\n]\n')
+        else:
+            for i, entry in enumerate(selected):
+                fp.write((i and '\n\n' or '') +
+                         _format_entry(entry) + '\n')
+    finally:
+        if fp is not sys.stdout:
+            fp.close()
+
+
+def _date_type(text):
+    # argparse reports ValueErrors raised by type functions generically,
+    # so we wrap ours in its own error type.
+    try:
+        return parse_date(text)
+    except ValueError as e:
+        raise ArgumentTypeError(str(e))
+
+
+def add_subcommands(subparsers):
+    """Add the headless subcommands to the argparse SUBPARSERS."""
+
+    def _add(name, func, streaming=False):
+        subparser = subparsers.add_parser(name, help=func.__doc__,
+                                          description=func.__doc__)
+        # --file is also accepted before the subcommand name, so don't
+        # let the default here clobber it.
+        subparser.add_argument('--file', metavar='FILE', default=SUPPRESS,
+                               help='the name of the ThotKeeper diary file')
+        subparser.set_defaults(command_func=func, command_streams=streaming)
+        return subparser
+
+    def _add_filters(subparser):
+        subparser.add_argument('--from', dest='start', type=_date_type,
+                               metavar='YYYY-MM-DD',
+                               help='skip entries before this date')
+        subparser.add_argument('--to', dest='end', type=_date_type,
+                               metavar='YYYY-MM-DD',
+                               help='skip entries after this date')
+        subparser.add_argument('--tag',
+                               help='only entries with this tag (or one '
+                                    'beneath it)')
+
+    _add_filters(_add('list', cmd_list))
+
+    subparser = _add('show', cmd_show)
+    subparser.add_argument('date', type=_date_type, metavar='YYYY-MM-DD')
+    subparser.add_argument('id', type=int, nargs='?',
+                           help='the entry for the date to show (default: '
+                                'all of them)')
+
+    subparser = _add('add', cmd_add)
+    subparser.add_argument('--date', type=_date_type, metavar='YYYY-MM-DD',
+                           help='date of the entry (default: today)')
+    subparser.add_argument('--subject', help='subject of the entry')
+    subparser.add_argument('--author', help='author of the entry')
+    subparser.add_argument('--tag', dest='tags', action='append',
+                           default=[],
+                           help='tag for the entry (may be repeated)')
+    subparser.add_argument('text', nargs='?',
+                           help='text of the entry (default, or if "-": '
+                                'read from standard input)')
+
+    subparser = _add('search', cmd_search)
+    subparser.add_argument('query',
+                           help='words, "quoted phrases", and ORs to '
+                                'search for')
+
+    _add('tags', cmd_tags)
+
+    _add_filters(_add('stats', cmd_stats, streaming=True))
+
+    subparser = _add('export', cmd_export, streaming=True)
+    _add_filters(subparser)
+    subparser.add_argument('--format', choices=['text', 'json'],
+                           default='text', help='output format')
+    subparser.add_argument('--output', metavar='PATH',
+                           help='file to write (default: standard output)')
+
+
+def run(args):
+    """Run the subcommand selected by ARGS (as parsed with the help
+    of add_subcommands()).  Commands which only read through the
+    entries in turn are passed no TKEntries object, and stream them
+    from the file instead."""
+    if not args.file:
+        sys.stderr.write('Error: a diary file (--file) is required\n')
+        sys.exit(1)
+    try:
+        entries = None
+        if not args.command_streams:
+            entries = parse_data(args.file, use_cache=True)
+        args.command_func(entries, args)
+    except Exception as e:
+        sys.stderr.write(f'Error: {e}\n')
+        sys.exit(1)
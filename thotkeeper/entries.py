@@ -8,20 +8,44 @@
 #
 # Website: https://github.com/cmpilato/thotkeeper
 
-from functools import reduce
+from bisect import (bisect_left, insort)
+from contextlib import contextmanager
+from datetime import date
+from itertools import chain
+from sys import intern
+
+
+def _find_sorted(keys, key):
+    """Return the index of KEY in the sorted list KEYS, or None if
+    KEY isn't in that list."""
+    try:
+        idx = bisect_left(keys, key)
+    except TypeError:
+        return None
+    if idx < len(keys) and keys[idx] == key:
+        return idx
+    return None
 
 
 class TKEntry:
+    """A single diary entry.  Diaries can carry hundreds of thousands
+    of these, so they're kept compact:  instances have no per-instance
+    dictionary, and the (often repeated) author and tag strings are
+    interned, with the tags stored as an immutable tuple."""
+
+    __slots__ = ('author', 'subject', 'text', 'year', 'month', 'day',
+                 'id', 'tags')
+
     def __init__(self, author='', subject='', text='',
-                 year=None, month=None, day=None, id=None, tags=[]):
-        self.author = author
+                 year=None, month=None, day=None, id=None, tags=()):
+        self.author = author and intern(author)
         self.subject = subject
         self.text = text
         self.year = year
         self.month = month
         self.day = day
         self.id = id
-        self.tags = tags
+        self.tags = tuple([intern(tag) for tag in tags or ()])
 
     def get_author(self):
         return self.author
@@ -42,49 +66,434 @@ class TKEntry:
         return self.tags
 
     def __eq__(self, other):
-        return ([self.year, self.month, self.day, self.id] ==
-                [other.year, other.month, other.day, other.id])
+        return ((self.year, self.month, self.day, self.id) ==
+                (other.year, other.month, other.day, other.id))
+
+    def __lt__(self, other):
+        return ((self.year, self.month, self.day, self.id) <
+                (other.year, other.month, other.day, other.id))
+
+
+class TKEntryTag:
+    """ThotKeeper Entry tag name."""
+
+    __slots__ = ('name', 'sort_key')
+
+    def __init__(self, name):
+        self.name = (name or '').strip('/')
+        # Tag names look like multi-component paths and sort
+        # similarly, where children follow their parents, but precede
+        # the later siblings of their parents -- which is just how
+        # tuples of their components sort.
+        self.sort_key = tuple(self.name.split('/'))
+
+    def __eq__(self, other):
+        return self.name == other.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    # NOTE: For historical reasons (upon which the tag tree's item
+    # order depends), a tag compares as "greater" than the tags it
+    # sorts before.
+    def __gt__(self, other):
+        return self.sort_key < other.sort_key
+
+    def __lt__(self, other):
+        return self.sort_key > other.sort_key
+
+
+class TKEntryKey:
+    """The key of a ThotKeeper entry (or, with a year of None, of a
+    tag), as carried by the items of the entry and tag trees.  Keys
+    with dates sort before those without; otherwise, keys sort by tag
+    (see TKEntryTag) and then by date and id."""
+
+    __slots__ = ('year', 'month', 'day', 'id', 'tag', 'date_key', 'hash')
+
+    def __init__(self, year, month, day, id, tag=None):
+        self.year = year
+        self.month = month
+        self.day = day
+        self.id = id
+        self.tag = TKEntryTag(tag)
+        self.date_key = (year, month, day, id)
+        self.hash = hash((self.tag.name, self.date_key))
+
+    def __eq__(self, other):
+        return (self.date_key == other.date_key and
+                self.tag.name == other.tag.name)
+
+    def __hash__(self):
+        return self.hash
 
     def __lt__(self, other):
-        return ([self.year, self.month, self.day, self.id] <
-                [other.year, other.month, other.day, other.id])
+        if self.year is not None and other.year is None:
+            return True
+        if self.year is None and other.year is not None:
+            return False
+        if self.tag.name != other.tag.name:
+            return self.tag.sort_key > other.tag.sort_key
+        return self.date_key < other.date_key
+
+    def __gt__(self, other):
+        return other.__lt__(self)
+
+
+class _TKTagNode:
+    __slots__ = ('children', 'entry_keys')
+
+    def __init__(self):
+        self.children = {}     # tag component -> _TKTagNode
+        self.entry_keys = None  # set of entry keys, if this is a tag
+
+
+class TKTagTrie:
+    """A map of tags to the set of keys -- (year, month, day, id)
+    tuples -- of the entries which carry them, stored as a trie of
+    slash-separated tag components so that whole tag hierarchies (and
+    tags beginning with a given string) can be found without scanning
+    every tag."""
+
+    def __init__(self):
+        self.root = _TKTagNode()
+
+    def _find_node(self, tag):
+        node = self.root
+        for component in tag.split('/'):
+            node = node.children.get(component)
+            if node is None:
+                return None
+        return node
+
+    def add(self, tag, entry_key):
+        """Associate ENTRY_KEY with TAG."""
+        node = self.root
+        for component in tag.split('/'):
+            child = node.children.get(component)
+            if child is None:
+                child = node.children[component] = _TKTagNode()
+            node = child
+        if node.entry_keys is None:
+            node.entry_keys = set()
+        node.entry_keys.add(entry_key)
+
+    def add_keys(self, tag, entry_keys):
+        """Associate each of ENTRY_KEYS with TAG."""
+        node = self.root
+        for component in tag.split('/'):
+            child = node.children.get(component)
+            if child is None:
+                child = node.children[component] = _TKTagNode()
+            node = child
+        if node.entry_keys is None:
+            node.entry_keys = set(entry_keys)
+        else:
+            node.entry_keys.update(entry_keys)
+
+    def _find_path(self, components):
+        """Return the list of nodes from the root to the node for the
+        tag whose components are COMPONENTS, or None if there is no
+        such node."""
+        path = [self.root]
+        for component in components:
+            node = path[-1].children.get(component)
+            if node is None:
+                return None
+            path.append(node)
+        return path
+
+    def _prune(self, path, components):
+        """Prune the no-longer-needed nodes along PATH (as returned by
+        _find_path(COMPONENTS)), from the bottom up."""
+        while len(path) > 1:
+            node = path.pop()
+            if node.children or node.entry_keys is not None:
+                break
+            del path[-1].children[components[len(path) - 1]]
+
+    def discard(self, tag, entry_key):
+        """Disassociate ENTRY_KEY from TAG, pruning TAG if this leaves
+        it with no entries.  Return True iff the association existed."""
+        components = tag.split('/')
+        path = self._find_path(components)
+        if path is None:
+            return False
+        node = path[-1]
+        if node.entry_keys is None or entry_key not in node.entry_keys:
+            return False
+        node.entry_keys.remove(entry_key)
+        if not node.entry_keys:
+            node.entry_keys = None
+            self._prune(path, components)
+        return True
+
+    def _merge_node(self, target, source):
+        if source.entry_keys is not None:
+            if target.entry_keys is None:
+                target.entry_keys = source.entry_keys
+            else:
+                target.entry_keys.update(source.entry_keys)
+        for component, child in source.children.items():
+            target_child = target.children.get(component)
+            if target_child is None:
+                target.children[component] = child
+            else:
+                self._merge_node(target_child, child)
+
+    def rename(self, old, new):
+        """Move the tag OLD, and the tags beneath it, to NEW (merging
+        them with any tags already found there).  Return a list of
+        (old tag, new tag, entry keys) tuples for the moved tags."""
+        components = old.split('/')
+        path = self._find_path(components)
+        if path is None:
+            return []
+        node = path[-1]
+        moved = [(tag, new + tag[len(old):], tuple(entry_keys))
+                 for tag, entry_keys in self._walk(node, old)]
+        del path[-2].children[components[-1]]
+        self._prune(path[:-1], components[:-1])
+
+        parent = self.root
+        new_components = new.split('/')
+        for component in new_components[:-1]:
+            child = parent.children.get(component)
+            if child is None:
+                child = parent.children[component] = _TKTagNode()
+            parent = child
+        target = parent.children.get(new_components[-1])
+        if target is None:
+            parent.children[new_components[-1]] = node
+        else:
+            self._merge_node(target, node)
+        return moved
+
+    def get(self, tag):
+        """Return the set of keys of the entries carrying TAG, or None
+        if there are no such entries."""
+        node = self._find_node(tag)
+        if node is None:
+            return None
+        return node.entry_keys
+
+    def __contains__(self, tag):
+        return self.get(tag) is not None
+
+    def _walk(self, node, name):
+        """Generate (tag, entry keys) pairs for the tags at or beneath
+        NODE, whose tag name is NAME."""
+        stack = [(node, name)]
+        while stack:
+            node, name = stack.pop()
+            if node.entry_keys is not None:
+                yield name, node.entry_keys
+            for component, child in node.children.items():
+                stack.append((child, name + '/' + component))
+
+    def items(self):
+        """Generate (tag, entry keys) pairs for all the tags."""
+        for component, child in self.root.children.items():
+            for item in self._walk(child, component):
+                yield item
+
+    def iter_sorted(self):
+        """Generate (tag, entry keys) pairs for every node of the trie
+        -- including those of tags which are only the parents of other
+        tags, whose entry keys are None -- in hierarchical order:  each
+        tag before the tags beneath it, which precede its later
+        siblings."""
+        stack = [(None, self.root)]
+        while stack:
+            name, node = stack.pop()
+            if name is not None:
+                yield name, node.entry_keys
+            prefix = name is not None and name + '/' or ''
+            for component in sorted(node.children, reverse=True):
+                stack.append((prefix + component, node.children[component]))
+
+    def tags(self):
+        """Generate all the tags."""
+        for tag, entry_keys in self.items():
+            yield tag
+
+    def subtree_keys(self, tag):
+        """Return an iterator over the sets of keys of the entries
+        carrying TAG or any tag beneath it in the tag hierarchy."""
+        node = self._find_node(tag)
+        if node is None:
+            return iter(())
+        return (entry_keys for name, entry_keys in self._walk(node, tag))
+
+    def complete(self, prefix):
+        """Return a sorted list of the tags which begin with the string
+        PREFIX."""
+        components = prefix.split('/')
+        node = self.root
+        name = None
+        for component in components[:-1]:
+            node = node.children.get(component)
+            if node is None:
+                return []
+            name = component if name is None else name + '/' + component
+        matches = []
+        for component, child in node.children.items():
+            if component.startswith(components[-1]):
+                child_name = (component if name is None
+                              else name + '/' + component)
+                matches.extend([tag for tag, entry_keys
+                                in self._walk(child, child_name)])
+        return sorted(matches)
+
+
+class TKChangeSet:
+    """The (coalesced) set of changes made to a TKEntries object
+    during a batch of mutations.  Only the final state of each changed
+    entry, and of each changed association between a tag and an entry,
+    is recorded."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.entry_changes = {}  # entry key -> TKEntry, or None if removed
+        self.tag_changes = {}    # (tag, entry key) -> (TKEntry, added?)
+
+    def __bool__(self):
+        return bool(self.entry_changes or self.tag_changes)
+
+    def get_entry_changes(self):
+        """Return a list of (entry, year, month, day, id) tuples -- the
+        same arguments an entry listener would receive -- for the
+        changed entries, in key order.  ENTRY is None for removed
+        entries."""
+        return [(entry,) + entry_key for entry_key, entry
+                in sorted(self.entry_changes.items())]
+
+    def get_tag_changes(self):
+        """Return a list of (tag, entry, added) tuples -- the same
+        arguments a tag listener would receive -- for the changed tag
+        associations, ordered by tag and entry key."""
+        return [(tag, entry, added) for (tag, entry_key), (entry, added)
+                in sorted(self.tag_changes.items())]
 
 
 class TKEntries:
     def __init__(self):
         self.entry_tree = {}
-        self.tag_tree = {}
-        self.listeners = []
-        self.tag_listeners = []
+        self.tag_trie = TKTagTrie()
+        # Sorted key indexes for the entry tree, mapping the keys of
+        # each populated level of ENTRY_TREE to a sorted list of the
+        # keys populated beneath it.
+        self.sorted_years = []
+        self.sorted_months = {}  # year -> [month, ...]
+        self.sorted_days = {}    # (year, month) -> [day, ...]
+        self.sorted_ids = {}     # (year, month, day) -> [id, ...]
+        # ... a bitmask per populated month of the days which have
+        # entries (bit 1 << DAY is set for each such DAY) ...
+        self.day_masks = {}      # (year, month) -> int
+        # ... and a flat, sorted list of (date ordinal, id) keys of all
+        # the entries, for date range queries.
+        self.sorted_keys = []
+        self.listeners = []      # [(func, changeset_func), ...]
+        self.tag_listeners = []  # [(func, changeset_func, rename_func), ...]
+        self.changeset = None
+        self.batch_depth = 0
         self.author_name = None
         self.author_global = True
 
-    def register_listener(self, func):
+    def register_listener(self, func, changeset_func=None):
         """Append FUNC to the list of functions called whenever one of
         the diary entries changes.  FUNC is a callback which accepts
-        the following: this instance, an event, year, month, and day."""
-        self.listeners.append(func)
+        the following: the changed TKEntry (or None if it was removed),
+        year, month, day, and id.
+
+        Changes made within a batch() are instead delivered all at
+        once when the batch completes:  as a single call to
+        CHANGESET_FUNC with the TKChangeSet, if provided, or else as a
+        call to FUNC for each changed entry."""
+        self.listeners.append((func, changeset_func))
+
+    def register_tag_listener(self, func, changeset_func=None,
+                              rename_func=None):
+        """Append FUNC to the list of functions called whenever the
+        association of a tag with an entry is added (or refreshed) or
+        removed.  FUNC is a callback which accepts the following: the
+        tag, the TKEntry, and a flag which is set for additions.
+        CHANGESET_FUNC is as for register_listener().
+
+        RENAME_FUNC, if provided, is called for each rename_tag() with
+        the old and new tag names and a list of (old tag, new tag,
+        TKEntry) tuples, one per renamed tag association.  Otherwise,
+        FUNC is called to remove each old association and add each new
+        one."""
+        self.tag_listeners.append((func, changeset_func, rename_func))
+
+    @contextmanager
+    def batch(self):
+        """Return a context manager within which changes made to the
+        entries are collected, rather than reported immediately to the
+        listeners, who instead receive them all at once upon exit from
+        the (outermost) batch.  For example:
+
+           with entries.batch():
+               for entry in new_entries:
+                   entries.store_entry(entry)
+        """
+        if not self.batch_depth:
+            self.changeset = TKChangeSet(self)
+        self.batch_depth = self.batch_depth + 1
+        try:
+            yield self.changeset
+        finally:
+            self.batch_depth = self.batch_depth - 1
+            if not self.batch_depth:
+                changeset = self.changeset
+                self.changeset = None
+                if changeset:
+                    self._notify_changeset(changeset)
+
+    def _notify_changeset(self, changeset):
+        if changeset.tag_changes:
+            for func, changeset_func, rename_func in self.tag_listeners:
+                if changeset_func:
+                    changeset_func(changeset)
+                else:
+                    for args in changeset.get_tag_changes():
+                        func(*args)
+        if changeset.entry_changes:
+            for func, changeset_func in self.listeners:
+                if changeset_func:
+                    changeset_func(changeset)
+                else:
+                    for args in changeset.get_entry_changes():
+                        func(*args)
+
+    def _notify(self, entry, year, month, day, id):
+        if self.changeset is not None:
+            self.changeset.entry_changes[(year, month, day, id)] = entry
+            return
+        for func, changeset_func in self.listeners:
+            func(entry, year, month, day, id)
 
-    def register_tag_listener(self, func):
-        self.tag_listeners.append(func)
+    def _notify_tag(self, tag, entry, added):
+        if self.changeset is not None:
+            entry_key = (entry.year, entry.month, entry.day, entry.id)
+            self.changeset.tag_changes[(tag, entry_key)] = (entry, added)
+            return
+        for func, changeset_func, rename_func in self.tag_listeners:
+            func(tag, entry, added)
 
     def enumerate_entries(self, func):
         """Call FUNC for each diary entry, ordered by time and
         intra-day index.  FUNC is a callback which accepts a TKEntry
-        parameter."""
-        years = self.get_years()
-        years.sort()
-        for year in years:
-            months = self.get_months(year)
-            months.sort()
-            for month in months:
-                days = self.get_days(year, month)
-                days.sort()
-                for day in days:
-                    ids = self.get_ids(year, month, day)
-                    ids.sort()
-                    for id in ids:
-                        func(self.get_entry(year, month, day, id))
+        parameter, and which must not add or remove entries."""
+        for year in self.sorted_years:
+            year_entries = self.entry_tree[year]
+            for month in self.sorted_months[year]:
+                month_entries = year_entries[month]
+                for day in self.sorted_days[(year, month)]:
+                    day_entries = month_entries[day]
+                    for id in self.sorted_ids[(year, month, day)]:
+                        func(day_entries[id])
 
     def enumerate_tag_entries(self, func):
         tags = sorted(self.get_tags())
@@ -99,44 +508,206 @@ class TKEntries:
         Notify the tag listeners of relevant changes.  If this change
         removes the last association of an entry with a given tag,
         prune the tag."""
-        addtags = [x for x in newtags if x not in oldtags]
-        removetags = [x for x in oldtags if x not in newtags]
-        for tag in newtags:
-            for func in self.tag_listeners:
-                func(tag, entry, True)
+        if oldtags:
+            addtags = [x for x in newtags if x not in oldtags]
+            removetags = [x for x in oldtags if x not in newtags]
+        else:
+            addtags = newtags
+            removetags = []
+        if self.tag_listeners:
+            for tag in newtags:
+                self._notify_tag(tag, entry, True)
+        if not (addtags or removetags):
+            return
+        entry_key = (entry.year, entry.month, entry.day, entry.id)
         for tag in addtags:
-            if tag not in self.tag_tree:
-                self.tag_tree[tag] = set()
-            self.tag_tree[tag].add((entry.year, entry.month,
-                                    entry.day, entry.id))
+            self.tag_trie.add(tag, entry_key)
         for tag in removetags:
-            if tag not in self.tag_tree:
-                continue
-            entry_key = (entry.year, entry.month, entry.day, entry.id)
-            if entry_key in self.tag_tree[tag]:
-                self.tag_tree[tag].remove(entry_key)
-                for func in self.tag_listeners:
-                    func(tag, entry, False)
-                if not self.tag_tree[tag]:
-                    del self.tag_tree[tag]
+            if self.tag_trie.discard(tag, entry_key):
+                self._notify_tag(tag, entry, False)
+
+    def rename_tag(self, old, new):
+        """Rename the tag OLD to NEW on every entry which carries it,
+        along with the tags beneath it in the tag hierarchy (so
+        OLD/subtag becomes NEW/subtag).  Each affected entry is replaced
+        by a copy carrying the renamed tags (stored entries are never
+        modified in place, so others may safely hold on to them), and
+        only the renamed tags of each are touched.  Tag listeners
+        receive a single rename notification (see
+        register_tag_listener()); entry listeners receive a change set
+        of the affected entries."""
+        if old == new:
+            return
+        moved = self.tag_trie.rename(old, new)
+        if not moved:
+            return
+        tag_map = {}
+        affected = {}  # entry key -> TKEntry
+        for old_tag, new_tag, entry_keys in moved:
+            tag_map[old_tag] = new_tag
+            for entry_key in entry_keys:
+                affected[entry_key] = None
+        for entry_key in affected:
+            year, month, day, id = entry_key
+            day_entries = self.entry_tree[year][month][day]
+            entry = day_entries[id]
+            tags = []
+            for tag in entry.tags:
+                tag = tag_map.get(tag, tag)
+                if tag not in tags:
+                    tags.append(tag)
+            entry = TKEntry(entry.author, entry.subject, entry.text,
+                            year, month, day, id, tags)
+            day_entries[id] = affected[entry_key] = entry
+        renamed = []   # [(old tag, new tag, TKEntry), ...]
+        for old_tag, new_tag, entry_keys in moved:
+            for entry_key in entry_keys:
+                renamed.append((old_tag, new_tag, affected[entry_key]))
+
+        if self.changeset is not None:
+            for old_tag, new_tag, entry in renamed:
+                self._notify_tag(old_tag, entry, False)
+                self._notify_tag(new_tag, entry, True)
+            self.changeset.entry_changes.update(affected)
+            return
+        for func, changeset_func, rename_func in self.tag_listeners:
+            if rename_func:
+                rename_func(old, new, renamed)
+            else:
+                for old_tag, new_tag, entry in renamed:
+                    func(old_tag, entry, False)
+                    func(new_tag, entry, True)
+        changeset = TKChangeSet(self)
+        changeset.entry_changes.update(affected)
+        self._notify_changeset(changeset)
+
+    def _index_key(self, year, month, day, id):
+        """Add the key of a newly stored entry to the sorted key
+        indexes."""
+        insort(self.sorted_keys, (date(year, month, day).toordinal(), id))
+        ids = self.sorted_ids.get((year, month, day))
+        if ids is None:
+            ids = self.sorted_ids[(year, month, day)] = []
+            days = self.sorted_days.get((year, month))
+            if days is None:
+                days = self.sorted_days[(year, month)] = []
+                months = self.sorted_months.get(year)
+                if months is None:
+                    months = self.sorted_months[year] = []
+                    insort(self.sorted_years, year)
+                insort(months, month)
+            insort(days, day)
+            self.day_masks[(year, month)] = \
+                self.day_masks.get((year, month), 0) | (1 << day)
+        insort(ids, id)
+
+    def _unindex_key(self, year, month, day, id):
+        """Remove the key of a removed entry from the sorted key
+        indexes, pruning any levels left empty."""
+        keys = self.sorted_keys
+        del keys[bisect_left(keys, (date(year, month, day).toordinal(), id))]
+        ids = self.sorted_ids[(year, month, day)]
+        del ids[bisect_left(ids, id)]
+        if ids:
+            return
+        del self.sorted_ids[(year, month, day)]
+        days = self.sorted_days[(year, month)]
+        del days[bisect_left(days, day)]
+        if days:
+            self.day_masks[(year, month)] &= ~(1 << day)
+            return
+        del self.sorted_days[(year, month)]
+        del self.day_masks[(year, month)]
+        months = self.sorted_months[year]
+        del months[bisect_left(months, month)]
+        if months:
+            return
+        del self.sorted_months[year]
+        del self.sorted_years[bisect_left(self.sorted_years, year)]
+
+    def _rebuild_indexes(self):
+        """Rebuild the sorted key indexes from the entry tree."""
+        self.sorted_years = sorted(self.entry_tree.keys())
+        self.sorted_months = {}
+        self.sorted_days = {}
+        self.sorted_ids = {}
+        self.day_masks = {}
+        self.sorted_keys = []
+        for year, year_entries in self.entry_tree.items():
+            self.sorted_months[year] = sorted(year_entries.keys())
+            for month, month_entries in year_entries.items():
+                self.sorted_days[(year, month)] = \
+                    sorted(month_entries.keys())
+                mask = 0
+                for day in month_entries.keys():
+                    mask |= 1 << day
+                self.day_masks[(year, month)] = mask
+                for day, day_entries in month_entries.items():
+                    self.sorted_ids[(year, month, day)] = \
+                        sorted(day_entries.keys())
+                    ordinal = date(year, month, day).toordinal()
+                    self.sorted_keys.extend([(ordinal, id)
+                                             for id in day_entries.keys()])
+        self.sorted_keys.sort()
 
     def store_entry(self, entry):
         year, month, day = entry.get_date()
-        if year not in self.entry_tree:
-            self.entry_tree[year] = {}
-        if month not in self.entry_tree[year]:
-            self.entry_tree[year][month] = {}
-        if day not in self.entry_tree[year][month]:
-            self.entry_tree[year][month][day] = {}
+        months = self.entry_tree.setdefault(year, {})
+        days = months.setdefault(month, {})
+        day_entries = days.setdefault(day, {})
         id = entry.get_id()
         oldtags = []
-        if id in self.entry_tree[year][month][day]:
-            oldtags = sorted(self.entry_tree[year][month][day][id].tags)
-        self.entry_tree[year][month][day][id] = entry
+        if id in day_entries:
+            oldtags = sorted(day_entries[id].tags)
+        else:
+            self._index_key(year, month, day, id)
+        day_entries[id] = entry
         newtags = sorted(entry.tags)
         self._update_tags(oldtags, newtags, entry)
-        for func in self.listeners:
-            func(entry, year, month, day, id)
+        self._notify(entry, year, month, day, id)
+
+    def load_entries(self, entries):
+        """Store the TKEntry objects in the iterable ENTRIES in bulk,
+        as when loading a diary:  rather than updating the sorted key
+        indexes and tag trie entry by entry (as store_entry() does),
+        this fills in the entry tree and then rebuilds those once.
+        Later entries replace earlier ones with the same key.  Listeners
+        are not notified, and are expected to build their views
+        afterward."""
+        tree = self.entry_tree
+        last_date = None
+        day_entries = None
+        for entry in entries:
+            # Diaries are stored in date order, so consecutive entries
+            # usually share a day.
+            entry_date = (entry.year, entry.month, entry.day)
+            if entry_date != last_date:
+                last_date = entry_date
+                months = tree.get(entry.year)
+                if months is None:
+                    months = tree[entry.year] = {}
+                days = months.get(entry.month)
+                if days is None:
+                    days = months[entry.month] = {}
+                day_entries = days.get(entry.day)
+                if day_entries is None:
+                    day_entries = days[entry.day] = {}
+            day_entries[entry.id] = entry
+        self._rebuild_indexes()
+
+        tag_keys = {}  # tag -> [entry key, ...]
+        for year, year_entries in tree.items():
+            for month, month_entries in year_entries.items():
+                for day, day_entries in month_entries.items():
+                    for id, entry in day_entries.items():
+                        for tag in entry.tags:
+                            keys = tag_keys.get(tag)
+                            if keys is None:
+                                keys = tag_keys[tag] = []
+                            keys.append((year, month, day, id))
+        self.tag_trie = TKTagTrie()
+        for tag, keys in tag_keys.items():
+            self.tag_trie.add_keys(tag, keys)
 
     def remove_entry(self, year, month, day, id):
         entry = self.entry_tree[year][month][day][id]
@@ -149,43 +720,155 @@ class TKEntries:
             del self.entry_tree[year][month]
         if not len(list(self.entry_tree[year].keys())):
             del self.entry_tree[year]
-        for func in self.listeners:
-            func(None, year, month, day, id)
+        self._unindex_key(year, month, day, id)
+        self._notify(None, year, month, day, id)
+
+    def _move_day(self, other, year, month, day):
+        """Move the entries for YEAR, MONTH, and DAY into the TKEntries
+        object OTHER, without notifying listeners or pruning emptied
+        parents."""
+        day_entries = self.entry_tree[year][month].pop(day)
+        other_months = other.entry_tree.setdefault(year, {})
+        other_days = other_months.setdefault(month, {})
+        other_days.setdefault(day, {}).update(day_entries)
+        for entry in day_entries.values():
+            entry_key = (entry.year, entry.month, entry.day, entry.id)
+            for tag in entry.tags:
+                self.tag_trie.discard(tag, entry_key)
+                other.tag_trie.add(tag, entry_key)
+
+    def split(self, year, month, day):
+        """Move all the entries dated before YEAR, MONTH, and DAY out
+        of this object and into a new TKEntries object (which carries
+        no listeners), and return that object.  This is done in a
+        single pass, and without notifying listeners, who are expected
+        to rebuild their views afterward as necessary."""
+        older = TKEntries()
+        for entry_year in list(self.entry_tree.keys()):
+            if entry_year > year:
+                continue
+            months = self.entry_tree[entry_year]
+            for entry_month in list(months.keys()):
+                if (entry_year, entry_month) > (year, month):
+                    continue
+                for entry_day in list(months[entry_month].keys()):
+                    if (entry_year, entry_month, entry_day) < \
+                       (year, month, day):
+                        self._move_day(older, entry_year, entry_month,
+                                       entry_day)
+                if not months[entry_month]:
+                    del months[entry_month]
+            if not months:
+                del self.entry_tree[entry_year]
+        self._rebuild_indexes()
+        older._rebuild_indexes()
+        return older
+
+    def merge(self, other):
+        """Move all the entries out of the TKEntries object OTHER and
+        into this one, undoing a previous split().  As with split(),
+        listeners are not notified."""
+        for year in list(other.entry_tree.keys()):
+            for month in list(other.entry_tree[year].keys()):
+                for day in list(other.entry_tree[year][month].keys()):
+                    other._move_day(self, year, month, day)
+        other.entry_tree.clear()
+        other._rebuild_indexes()
+        self._rebuild_indexes()
+
+    def _range_bounds(self, start, end):
+        keys = self.sorted_keys
+        lo = 0
+        hi = len(keys)
+        if start is not None:
+            lo = bisect_left(keys, (start.toordinal(),))
+        if end is not None:
+            hi = bisect_left(keys, (end.toordinal(),), lo)
+        return lo, hi
+
+    def iter_range(self, start=None, end=None, reverse=False):
+        """Generate the TKEntry objects dated on or after the date
+        START and before the date END (either of which may be None,
+        leaving that end of the range open), ordered by time and
+        intra-day index, or in the opposite order if REVERSE is set.
+        The caller must not store or remove entries while iterating."""
+        keys = self.sorted_keys
+        lo, hi = self._range_bounds(start, end)
+        indices = reverse and range(hi - 1, lo - 1, -1) or range(lo, hi)
+        last_ordinal = None
+        day_entries = None
+        for idx in indices:
+            ordinal, id = keys[idx]
+            if ordinal != last_ordinal:
+                last_ordinal = ordinal
+                day_date = date.fromordinal(ordinal)
+                day_entries = self.entry_tree[day_date.year][
+                    day_date.month][day_date.day]
+            yield day_entries[id]
+
+    def __iter__(self):
+        return self.iter_range()
+
+    def count_range(self, start=None, end=None):
+        """Return the number of entries dated on or after the date
+        START and before the date END (either of which may be None,
+        leaving that end of the range open)."""
+        lo, hi = self._range_bounds(start, end)
+        return hi - lo
 
     def get_years(self):
         """Return the years which have days with associated TKEntry
-        objects."""
-        return list(self.entry_tree.keys())
+        objects, in ascending order."""
+        return list(self.sorted_years)
 
     def get_months(self, year):
         """Return the months in YEAR which have days with associated
-        TKEntry objects."""
-        return list(self.entry_tree[year].keys())
+        TKEntry objects, in ascending order."""
+        return list(self.sorted_months[year])
 
     def get_days(self, year, month):
         """Return the days in YEAR and MONTH which have associated
-        TKEntry objects."""
-        return list(self.entry_tree[year][month].keys())
+        TKEntry objects, in ascending order."""
+        return list(self.sorted_days[(year, month)])
+
+    def get_day_mask(self, year, month):
+        """Return a bitmask of the days in YEAR and MONTH which have
+        associated TKEntry objects:  bit 1 << DAY is set for each such
+        DAY."""
+        return self.day_masks.get((year, month), 0)
 
     def get_ids(self, year, month, day):
         """Return the IDS in YEAR, MONTH, and DAY which have associated
-        TKEntry objects."""
-        return list(self.entry_tree[year][month][day].keys())
+        TKEntry objects, in ascending order."""
+        return list(self.sorted_ids[(year, month, day)])
 
     def get_tags(self):
-        return list(self.tag_tree.keys())
+        return list(self.tag_trie.tags())
+
+    def complete_tag(self, prefix):
+        """Return a sorted list of the tags which begin with the string
+        PREFIX."""
+        return self.tag_trie.complete(prefix)
 
     def get_entries_by_tag(self, tag):
-        entry_keys = self.tag_tree[tag]
+        entry_keys = self.tag_trie.get(tag)
+        if entry_keys is None:
+            raise KeyError(tag)
         return [self.entry_tree[x[0]][x[1]][x[2]][x[3]] for x in entry_keys]
 
     def get_entries_by_partial_tag(self, tagstart):
-        """Return all the entries that start with tagstart"""
-        tagstartsep = tagstart + '/'
-        taglist = [x for x in list(self.tag_tree.keys())
-                   if ((x == tagstart) or (x.startswith(tagstartsep)))]
-        entrylist = list(map(self.get_entries_by_tag, taglist))
-        return reduce(lambda x, y: x + y, entrylist)
+        """Return an iterator over the entries carrying the tag
+        TAGSTART or any tag beneath it in the tag hierarchy (such as
+        TAGSTART/subtag), each entry appearing once.  Entries are found
+        lazily, so the caller must not store or remove entries while
+        iterating."""
+        seen = set()
+        for entry_key in chain.from_iterable(
+                self.tag_trie.subtree_keys(tagstart)):
+            if entry_key not in seen:
+                seen.add(entry_key)
+                year, month, day, id = entry_key
+                yield self.entry_tree[year][month][day][id]
 
     def get_entry(self, year, month, day, id):
         """Return the TKEntry associated with YEAR, MONTH, and DAY,
@@ -197,21 +880,17 @@ class TKEntries:
 
     def get_first_id(self, year, month, day):
         """Return the id of the first entry for that day"""
-        try:
-            day_keys = list(self.entry_tree[year][month][day].keys())
-            day_keys.sort()
-            return day_keys[0]
-        except Exception:
+        ids = self.sorted_ids.get((year, month, day))
+        if not ids:
             return None
+        return ids[0]
 
     def get_last_id(self, year, month, day):
         """Return the id of the last entry for that day"""
-        try:
-            day_keys = list(self.entry_tree[year][month][day].keys())
-            day_keys.sort()
-            return day_keys[-1]
-        except Exception:
+        ids = self.sorted_ids.get((year, month, day))
+        if not ids:
             return None
+        return ids[-1]
 
     def get_new_id(self, year, month, day):
         """Return the first unused id for a given day."""
@@ -226,39 +905,31 @@ class TKEntries:
         entries for YEAR, MONTH, DAY.  If ID is not found, return the
         position in that list it would hold if appended to the list (1
         if the list is empty; number_of_entries + 1 otherwise)."""
-        try:
-            day_keys = list(self.entry_tree[year][month][day].keys())
-            day_keys.sort()
-        except Exception:
-            day_keys = []
-        try:
-            return day_keys.index(id) + 1
-        except Exception:
-            return len(day_keys) + 1
+        ids = self.sorted_ids.get((year, month, day), [])
+        idx = _find_sorted(ids, id)
+        if idx is None:
+            return len(ids) + 1
+        return idx + 1
 
     def get_next_id(self, year, month, day, id):
         """Return the id of the entry (in the set of entries for YEAR,
         MONTH, DAY) which follows the entry for ID, or None if no
         entries follow the one for ID."""
-        try:
-            day_keys = list(self.entry_tree[year][month][day].keys())
-            day_keys.sort()
-            idx = day_keys.index(id)
-            return day_keys[idx + 1]
-        except Exception:
+        ids = self.sorted_ids.get((year, month, day), [])
+        idx = _find_sorted(ids, id)
+        if idx is None or idx + 1 == len(ids):
             return None
+        return ids[idx + 1]
 
     def get_prev_id(self, year, month, day, id):
         """Return the id of the entry (in the set of entries for YEAR,
         MONTH, DAY) which precedes the entry for ID, or the last entry
         for that day if no entry for ID can be found."""
-        try:
-            day_keys = list(self.entry_tree[year][month][day].keys())
-            day_keys.sort()
-            idx = day_keys.index(id)
-            return day_keys[idx - 1]
-        except Exception:
+        ids = self.sorted_ids.get((year, month, day), [])
+        idx = _find_sorted(ids, id)
+        if idx is None:
             return self.get_last_id(year, month, day)
+        return ids[idx - 1]
 
     def get_author_name(self):
         return self.author_name
@@ -8,20 +8,86 @@
 #
 # Website: https://github.com/cmpilato/thotkeeper
 
+import contextlib
+import json
 import os
-import shutil
 import tempfile
+import threading
+import xml.parsers.expat
 import xml.sax
-from xml.sax.saxutils import escape as _xml_escape
+from .cache import (get_signature, load_cache, save_cache)
 from .entries import (TKEntries, TKEntry)
 
 TK_DATA_VERSION = 1
 
+# Engines available for parse_data().
+PARSE_ENGINE_EXPAT = 'expat'
+PARSE_ENGINE_SAX = 'sax'
+
+# Suffix of the change log which accompanies a datafile, and the size
+# (in bytes) beyond which callers should compact it back into the
+# datafile proper.
+CHANGELOG_SUFFIX = '.log'
+CHANGELOG_COMPACT_SIZE = 1024 * 1024
+
+# Policies for flushing written datafiles to disk; see unparse_data().
+FSYNC_NEVER = 'never'
+FSYNC_DATA = 'data'
+FSYNC_FULL = 'full'
+
+# Size (in bytes) of the output buffer used when writing datafiles, and
+# (in characters) of the chunks generated by serialize_data().
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Compression formats for datafiles.  Datafiles are read in whichever
+# format their leading bytes indicate, and written in the one their
+# filename extension calls for (see get_compression()).
+COMPRESSION_GZIP = 'gzip'
+COMPRESSION_XZ = 'xz'
+COMPRESSION_EXTENSIONS = {
+    '.gz': COMPRESSION_GZIP,
+    '.xz': COMPRESSION_XZ,
+    }
+_COMPRESSION_MAGIC = [
+    (b'\x1f\x8b', COMPRESSION_GZIP),
+    (b'\xfd7zXZ\x00', COMPRESSION_XZ),
+    ]
+
+# Filename extensions of (possibly compressed) datafiles.
+DATAFILE_EXTENSIONS = ('.tkj', '.tkj.gz', '.tkj.xz')
+
+# Compression settings used when writing datafiles.  Saves happen
+# often, so these favor speed:  the higher xz presets, in particular,
+# compress prose little better, and many times slower.
+GZIP_COMPRESS_LEVEL = 6
+XZ_COMPRESS_PRESET = 1
+
+# Serializes appends to change logs with their removal, which may
+# happen on different threads.
+_changelog_lock = threading.Lock()
+
+# The number of bytes trimmed from the front of each change log (keyed
+# by absolute path) by this process, so that marks taken with
+# get_changelog_mark() stay meaningful as the log is trimmed.  Guarded
+# by _changelog_lock.
+_changelog_discarded = {}
+
+
+def _xml_escape(data):
+    # This is xml.sax.saxutils.escape(), less the (surprisingly costly,
+    # via urllib) import of its module.
+    return data.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
 
 class TKDataVersionException(Exception):
     pass
 
 
+class TKParseCancelledException(Exception):
+    """Raised by parse_data() progress callbacks to abandon a parse."""
+    pass
+
+
 class TKDataParser(xml.sax.handler.ContentHandler):
     """XML Parser class for reading and writing diary data files.
 
@@ -91,6 +157,8 @@ class TKDataParser(xml.sax.handler.ContentHandler):
         self.buffer = None
         self.entries = entries
         self.tag_stack = []
+        self.parsed = None  # if a list, collects each entry parsed
+        self.loaded = []    # entries awaiting TKEntries.load_entries()
         self.entries.set_author_global(False)
         # If we are loading a file, we want there to be no global
         # author *unless* one is actually found in the file (but the
@@ -112,6 +180,9 @@ class TKDataParser(xml.sax.handler.ContentHandler):
         self.tag_stack.append(name)
 
         # ... and operate.
+        self._start_element(name, attrs)
+
+    def _start_element(self, name, attrs):
         if name == self.TKJ_TAG_DIARY:
             try:
                 version = int(attrs['version'])
@@ -137,17 +208,27 @@ class TKDataParser(xml.sax.handler.ContentHandler):
                     self.entries.set_author_global(False)
                 else:
                     self.entries.set_author_global(True)
-            self.buffer = ''
+            self.buffer = []
         elif name == self.TKJ_TAG_TAGS:
             self.cur_entry['tags'] = []
         elif name in [self.TKJ_TAG_SUBJECT,
                       self.TKJ_TAG_TAG,
                       self.TKJ_TAG_TEXT]:
-            self.buffer = ''
+            self.buffer = []
+
+    def _store_entry(self, entry):
+        # The entries are stored in bulk once all have been parsed (see
+        # _end_element()), which is far cheaper than one at a time.
+        self.loaded.append(entry)
+        if self.parsed is not None:
+            self.parsed.append(entry)
 
     def characters(self, ch):
+        # SAX may deliver character data in many small chunks, so we
+        # collect them in a list and join them only once the element
+        # closes (see endElement()).
         if self.buffer is not None:
-            self.buffer = self.buffer + ch
+            self.buffer.append(ch)
         return
 
     def endElement(self, name):
@@ -155,84 +236,608 @@ class TKDataParser(xml.sax.handler.ContentHandler):
         del self.tag_stack[-1]
 
         # ... and operate.
+        self._end_element(name)
+
+    def _end_element(self, name):
         if name == self.TKJ_TAG_ENTRY:
-            self.entries.store_entry(TKEntry(self.cur_entry.get('author', ''),
-                                             self.cur_entry.get('subject', ''),
-                                             self.cur_entry.get('text', ''),
-                                             int(self.cur_entry['year']),
-                                             int(self.cur_entry['month']),
-                                             int(self.cur_entry['day']),
-                                             int(self.cur_entry['id']),
-                                             self.cur_entry.get('tags', [])))
+            self._store_entry(TKEntry(self.cur_entry.get('author', ''),
+                                      self.cur_entry.get('subject', ''),
+                                      self.cur_entry.get('text', ''),
+                                      int(self.cur_entry['year']),
+                                      int(self.cur_entry['month']),
+                                      int(self.cur_entry['day']),
+                                      int(self.cur_entry['id']),
+                                      self.cur_entry.get('tags', [])))
             self.cur_entry = None
+        elif name == self.TKJ_TAG_ENTRIES:
+            self.entries.load_entries(self.loaded)
+            self.loaded = []
         elif name == self.TKJ_TAG_AUTHOR:
             if self.cur_entry:
-                self.cur_entry['author'] = self.buffer
+                self.cur_entry['author'] = ''.join(self.buffer)
             else:
-                self.entries.set_author_name(self.buffer)
+                self.entries.set_author_name(''.join(self.buffer))
             self.buffer = None
         elif name in [self.TKJ_TAG_SUBJECT, self.TKJ_TAG_TEXT]:
-            self.cur_entry[name] = self.buffer
+            self.cur_entry[name] = ''.join(self.buffer)
             self.buffer = None
         elif name == self.TKJ_TAG_TAG:
-            self.cur_entry['tags'].append(self.buffer)
+            self.cur_entry['tags'].append(''.join(self.buffer))
+            self.buffer = None
+
+
+class TKExpatParser(TKDataParser):
+    """XML Parser class for reading diary data files, built directly
+    atop the expat parser rather than the xml.sax framework.
+
+    This parser understands exactly the same formats as TKDataParser
+    (and populates its TKEntries object identically), but avoids the
+    per-event overhead that xml.sax adds:  expat calls our handlers
+    directly, coalesces character data itself, and hands us plain
+    attribute dictionaries.  Element nesting is validated against a
+    state table of (parent, child) transitions precomputed from
+    TKDataParser._valid_parents."""
+
+    BUFFER_SIZE = 65536
+
+    _valid_transitions = frozenset(
+        (parent, name)
+        for name, parents in TKDataParser._valid_parents.items()
+        for parent in (parents or [None]))
+
+    _text_tags = frozenset([TKDataParser.TKJ_TAG_SUBJECT,
+                            TKDataParser.TKJ_TAG_TAG,
+                            TKDataParser.TKJ_TAG_TEXT])
+
+    def __init__(self, entries):
+        TKDataParser.__init__(self, entries)
+        self.tag_stack = [None]
+        self.parser = xml.parsers.expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.buffer_size = self.BUFFER_SIZE
+        self.parser.StartElementHandler = self.startElement
+        self.parser.EndElementHandler = self.endElement
+
+    def parse(self, fp):
+        """Parse the diary data read from the binary file object FP."""
+        self.parser.ParseFile(fp)
+
+    def feed(self, data):
+        """Parse DATA, the next chunk of the diary's bytes."""
+        self.parser.Parse(data, False)
+
+    def close(self):
+        """Finish parsing the chunks passed to feed()."""
+        self.parser.Parse(b'', True)
+
+    def startElement(self, name, attrs):
+        # Validate ...
+        tag_stack = self.tag_stack
+        if (tag_stack[-1], name) not in self._valid_transitions:
+            raise Exception("Unexpected tag (%s) in parent (%s)"
+                            % (name, tag_stack[-1] or ""))
+        tag_stack.append(name)
+
+        # ... and operate.  (Text-bearing tags are by far the most
+        # common, so we check for those first.)  Character data only
+        # matters inside the elements that carry it, so that's the only
+        # time we ask expat to hand it to us -- and then straight into
+        # our buffer, with no Python method call in between.
+        if name in self._text_tags:
+            self.buffer = buffer = []
+            self.parser.CharacterDataHandler = buffer.append
+            return
+        elif name == self.TKJ_TAG_ENTRY:
+            if not ('month' in attrs and 'year' in attrs and 'day' in attrs):
+                raise Exception("Invalid XML file.")
+            self.cur_entry = attrs
+            if 'id' not in attrs:
+                attrs['id'] = '1'
+            return
+        elif name == self.TKJ_TAG_TAGS:
+            self.cur_entry['tags'] = []
+            return
+        else:
+            self._start_element(name, attrs)
+        if self.buffer is not None:
+            self.parser.CharacterDataHandler = self.buffer.append
+
+    def endElement(self, name):
+        # Pop from the tag stack ...
+        del self.tag_stack[-1]
+
+        # ... and operate, again handling the most common tags inline.
+        if name in self._text_tags:
+            self.parser.CharacterDataHandler = None
+            if name == self.TKJ_TAG_TAG:
+                self.cur_entry['tags'].append(''.join(self.buffer))
+            else:
+                self.cur_entry[name] = ''.join(self.buffer)
+            self.buffer = None
+        elif name == self.TKJ_TAG_ENTRY:
+            cur_entry = self.cur_entry
+            self._store_entry(TKEntry(cur_entry.get('author', ''),
+                                      cur_entry.get('subject', ''),
+                                      cur_entry.get('text', ''),
+                                      int(cur_entry['year']),
+                                      int(cur_entry['month']),
+                                      int(cur_entry['day']),
+                                      int(cur_entry['id']),
+                                      cur_entry.get('tags')))
+            self.cur_entry = None
+        else:
+            if self.buffer is not None:
+                self.parser.CharacterDataHandler = None
+            self._end_element(name)
+
+
+class TKExpatStreamParser(TKExpatParser):
+    """XML Parser class for streaming through diary data files.
+    Rather than storing the entries it parses in a TKEntries object,
+    this parser collects them in its 'parsed' list, skipping those
+    dated before START or on or after END (date objects, either of
+    which may be None), and -- if TAG is provided -- those not carrying
+    TAG or a tag beneath it.  The text of entries skipped by date is
+    never even collected."""
+
+    def __init__(self, start=None, end=None, tag=None):
+        TKExpatParser.__init__(self, TKEntries())
+        self.parsed = []
+        self.start = start and (start.year, start.month, start.day)
+        self.end = end and (end.year, end.month, end.day)
+        self.tag = tag and tag.strip('/')
+        self.skipping = False
+
+    def matches(self, entry):
+        """Return True iff ENTRY passes this parser's filters."""
+        entry_date = entry.get_date()
+        if self.start and entry_date < self.start:
+            return False
+        if self.end and entry_date >= self.end:
+            return False
+        if self.tag:
+            prefix = self.tag + '/'
+            for tag in entry.tags:
+                if tag == self.tag or tag.startswith(prefix):
+                    return True
+            return False
+        return True
+
+    def startElement(self, name, attrs):
+        TKExpatParser.startElement(self, name, attrs)
+        if name == self.TKJ_TAG_ENTRY:
+            entry_date = (int(attrs['year']), int(attrs['month']),
+                          int(attrs['day']))
+            self.skipping = ((self.start and entry_date < self.start) or
+                             (self.end and entry_date >= self.end))
+        elif self.skipping:
+            self.parser.CharacterDataHandler = None
+
+    def _store_entry(self, entry):
+        if not self.skipping and self.matches(entry):
+            self.parsed.append(entry)
+
 
+def iter_entries(datafile, start=None, end=None, tag=None):
+    """Generate the TKEntry objects of the XML file DATAFILE, one at a
+    time and in file order, without ever holding more than a chunk's
+    worth of them in memory.  Entries dated before START or on or after
+    END (date objects, either of which may be None), and -- if TAG is
+    provided -- those not carrying TAG or a tag beneath it, are skipped.
 
-def parse_data(datafile):
-    """Parse an XML file, returning a TKEntries object."""
+    Changes recorded in DATAFILE's change log are applied to the
+    entries as they go by; entries which exist only in the change log
+    come last."""
+    changes = read_changelog(datafile)
+    handler = TKExpatStreamParser(start, end, tag)
+    with _open_datafile(datafile) as (fp, raw):
+        while True:
+            data = fp.read(TKExpatParser.BUFFER_SIZE)
+            if data:
+                handler.feed(data)
+            else:
+                handler.close()
+            parsed = handler.parsed
+            handler.parsed = []
+            for entry in parsed:
+                key = (entry.year, entry.month, entry.day, entry.id)
+                if key in changes:
+                    entry = changes.pop(key)
+                    if entry is None or not handler.matches(entry):
+                        continue
+                yield entry
+            if not data:
+                break
+    for entry in changes.values():
+        if entry is not None and handler.matches(entry):
+            yield entry
+
+
+def get_compression(datafile):
+    """Return the compression format (COMPRESSION_GZIP,
+    COMPRESSION_XZ, or None for none) in which DATAFILE is written,
+    according to its filename extension."""
+    return COMPRESSION_EXTENSIONS.get(os.path.splitext(datafile)[1].lower())
+
+
+def _compressed_file(fp, compression, mode):
+    """Return a file object which reads (if MODE is 'rb') or writes
+    (if 'wb') data compressed in COMPRESSION format from/to the binary
+    file object FP, or FP itself if COMPRESSION is None.  Closing the
+    returned object does not close FP."""
+    # These modules (and the libraries behind them) are imported only
+    # when needed, as most datafiles aren't compressed.
+    if compression == COMPRESSION_GZIP:
+        import gzip
+        return gzip.GzipFile(fileobj=fp, mode=mode,
+                             compresslevel=GZIP_COMPRESS_LEVEL)
+    if compression == COMPRESSION_XZ:
+        import lzma
+        if mode == 'wb':
+            return lzma.LZMAFile(fp, mode=mode, preset=XZ_COMPRESS_PRESET)
+        return lzma.LZMAFile(fp, mode=mode)
+    return fp
+
+
+@contextlib.contextmanager
+def _open_datafile(datafile):
+    """Open DATAFILE for reading, returning a context manager which
+    yields (FP, RAW):  FP a binary file object which reads DATAFILE's
+    contents, decompressed as needed, and RAW the underlying file (whose
+    position reflects how much of DATAFILE has been consumed)."""
+    with open(datafile, 'rb') as raw:
+        magic = raw.read(8)
+        raw.seek(0)
+        compression = None
+        for prefix, format in _COMPRESSION_MAGIC:
+            if magic.startswith(prefix):
+                compression = format
+                break
+        fp = _compressed_file(raw, compression, 'rb')
+        try:
+            yield fp, raw
+        finally:
+            if fp is not raw:
+                fp.close()
+
+
+def parse_data(datafile, engine=PARSE_ENGINE_EXPAT, use_cache=False,
+               progress=None):
+    """Parse an XML file (which may be gzip- or xz-compressed),
+    returning a TKEntries object.  ENGINE
+    selects the XML parsing machinery used to do so:  either
+    PARSE_ENGINE_EXPAT (the faster default) or PARSE_ENGINE_SAX.  Both
+    produce identical results.
+
+    If USE_CACHE is set, consult DATAFILE's sidecar load cache before
+    parsing anything, and if that cache is missing or stale, rebuild
+    it (in the background) after successfully parsing DATAFILE.
+
+    If PROGRESS is provided, it is called periodically as
+    PROGRESS(BYTES_READ, BYTES_TOTAL, NEW_ENTRIES), where the byte
+    counts are of DATAFILE as stored (compressed or not), and NEW_ENTRIES
+    is a list of the TKEntry objects parsed since the previous call.
+    (Changes replayed from DATAFILE's change log are not reported.)
+    PROGRESS may abandon the parse by raising an exception -- say,
+    TKParseCancelledException -- which parse_data() propagates."""
     entries = TKEntries()
     if datafile:
-        handler = TKDataParser(entries)
-        xml.sax.parse(datafile, handler)
+        cached_entries = None
+        if use_cache:
+            cached_entries = load_cache(datafile)
+        if cached_entries is not None:
+            entries = cached_entries
+            if progress is not None:
+                size = os.path.getsize(datafile)
+                new_entries = []
+                entries.enumerate_entries(new_entries.append)
+                progress(size, size, new_entries)
+        else:
+            if use_cache:
+                signature = get_signature(datafile)
+            _parse_xml(datafile, entries, engine, progress)
+            if use_cache:
+                save_cache(datafile, entries, signature, background=True)
+
+        # Finally, apply any changes logged since DATAFILE was written.
+        _replay_changelog(datafile, entries)
     return entries
 
 
-def unparse_data(datafile, entries):
-    """Unparse a TKEntries object into an XML file, using an
+def _parse_xml(datafile, entries, engine, progress=None):
+    """Parse the XML DATAFILE into ENTRIES using ENGINE, reporting
+    to PROGRESS (if provided) as for parse_data()."""
+    if engine == PARSE_ENGINE_EXPAT:
+        handler = TKExpatParser(entries)
+        if progress is None:
+            with _open_datafile(datafile) as (fp, raw):
+                handler.parse(fp)
+            return
+        parser = handler
+    elif engine == PARSE_ENGINE_SAX:
+        handler = TKDataParser(entries)
+        if progress is None:
+            with _open_datafile(datafile) as (fp, raw):
+                xml.sax.parse(fp, handler)
+            return
+        parser = xml.sax.make_parser()
+        parser.setContentHandler(handler)
+    else:
+        raise Exception(f'Unknown parse engine "{engine}"')
+
+    # Feed the parser a chunk at a time, reporting on our progress
+    # after each one.
+    with _open_datafile(datafile) as (fp, raw):
+        bytes_total = os.fstat(raw.fileno()).st_size
+        bytes_read = 0
+        while True:
+            data = fp.read(TKExpatParser.BUFFER_SIZE)
+            if not data:
+                break
+            bytes_read = raw.tell()
+            handler.parsed = []
+            parser.feed(data)
+            progress(bytes_read, bytes_total, handler.parsed)
+        handler.parsed = []
+        parser.close()
+        if handler.parsed:
+            progress(bytes_read, bytes_total, handler.parsed)
+
+
+def get_changelog_path(datafile):
+    """Return the path of the change log for DATAFILE."""
+    return datafile + CHANGELOG_SUFFIX
+
+
+def get_changelog_mark(datafile):
+    """Return a mark of how much has been logged to the change log for
+    DATAFILE so far, for passing to unparse_data().  Unlike the log's
+    size, a mark stays valid while other saves trim the log."""
+    changelog = os.path.abspath(get_changelog_path(datafile))
+    with _changelog_lock:
+        try:
+            size = os.path.getsize(changelog)
+        except OSError:
+            size = 0
+        return _changelog_discarded.get(changelog, 0) + size
+
+
+def log_changes(datafile, stored=(), removed=()):
+    """Append records of entry changes to the change log for
+    DATAFILE, rather than rewriting DATAFILE itself.  STORED is a
+    sequence of TKEntry objects which have been stored; REMOVED is a
+    sequence of (year, month, day, id) keys of entries which have been
+    removed.  Removals are logged after stores.  Return the resulting
+    size of the change log.
+
+    The log holds one JSON array per line:
+
+       ["store", author, subject, text, year, month, day, id, [tag, ...]]
+       ["remove", year, month, day, id]
+
+    parse_data() replays it atop the datafile's contents, and
+    unparse_data() discards it once it has written a complete
+    datafile."""
+    records = []
+    for entry in stored:
+        year, month, day = entry.get_date()
+        records.append(['store', entry.get_author(), entry.get_subject(),
+                        entry.get_text(), year, month, day, entry.get_id(),
+                        list(entry.get_tags())])
+    for key in removed:
+        records.append(['remove'] + list(key))
+    data = ''.join([json.dumps(record, ensure_ascii=False) + '\n'
+                    for record in records])
+    with _changelog_lock:
+        with open(get_changelog_path(datafile), 'a', encoding='utf-8') as fp:
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+            return fp.tell()
+
+
+def read_changelog(datafile):
+    """Return a dictionary mapping the (year, month, day, id) keys of
+    the entries changed in DATAFILE's change log (if any) to their
+    final states:  TKEntry objects for stored entries, or None for
+    removed ones.  A record which can't be parsed -- say, one truncated
+    by a crash mid-write -- ends the log."""
+    changes = {}
+    try:
+        fp = open(get_changelog_path(datafile), 'r', encoding='utf-8')
+    except FileNotFoundError:
+        return changes
+    with fp:
+        for line in fp:
+            try:
+                record = json.loads(line)
+                op = record[0]
+                if op == 'store':
+                    entry = TKEntry(*record[1:9])
+                    changes[(entry.year, entry.month, entry.day,
+                             entry.id)] = entry
+                elif op == 'remove':
+                    changes[tuple(record[1:5])] = None
+                else:
+                    break
+            except Exception:
+                break
+    return changes
+
+
+def _replay_changelog(datafile, entries):
+    """Apply the changes recorded in DATAFILE's change log (if any)
+    to ENTRIES."""
+    for key, entry in read_changelog(datafile).items():
+        if entry is not None:
+            entries.store_entry(entry)
+        elif entries.get_entry(*key) is not None:
+            entries.remove_entry(*key)
+
+
+def serialize_data(entries, author_name=None, author_global=False):
+    """Generate the XML serialization of ENTRIES as a series of
+    strings, each (but the last) at least WRITE_BUFFER_SIZE characters
+    long.  ENTRIES may be a TKEntries object (or a snapshot of one),
+    whose author settings are used, or any other iterable of TKEntry
+    objects -- such as a TKEntries.iter_range() query, or the output of
+    iter_entries() -- in which case AUTHOR_NAME (if not None) and
+    AUTHOR_GLOBAL provide the author settings."""
+    if hasattr(entries, 'get_author_name'):
+        author_name = entries.get_author_name()
+        author_global = entries.get_author_global()
+    parts = ['<?xml version="1.0"?>\n'
+             '<diary version="%d">\n' % (TK_DATA_VERSION)]
+    if author_name is not None:
+        parts.append(' <author global="%s">%s</author>\n'
+                     % (author_global and "true" or "false",
+                        _xml_escape(author_name)))
+    parts.append(' <entries>\n')
+    size = 0
+
+    # Authors and tags are few and oft-repeated, so their escaped forms
+    # (and the markup around them) are remembered rather than redone.
+    authors = {'': '', None: ''}
+    tag_lists = {(): ''}
+    for entry in entries:
+        author = authors.get(entry.author)
+        if author is None:
+            author = authors[entry.author] = (
+                '   <author>%s</author>\n' % (_xml_escape(entry.author)))
+        tags = tag_lists.get(entry.tags)
+        if tags is None:
+            tags = tag_lists[entry.tags] = (
+                '   <tags>\n%s   </tags>\n'
+                % (''.join(['    <tag>%s</tag>\n' % (_xml_escape(tag))
+                            for tag in entry.tags])))
+        subject = ''
+        if entry.subject:
+            subject = ('   <subject>%s</subject>\n'
+                       % (_xml_escape(entry.subject)))
+        chunk = ('  <entry year="%s" month="%s" day="%s" id="%s">\n'
+                 '%s%s%s'
+                 '   <text>%s</text>\n'
+                 '  </entry>\n'
+                 % (entry.year, entry.month, entry.day, entry.id,
+                    author, subject, tags, _xml_escape(entry.text)))
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= WRITE_BUFFER_SIZE:
+            yield ''.join(parts)
+            parts = []
+            size = 0
+    parts.append(' </entries>\n</diary>\n')
+    yield ''.join(parts)
+
+
+def unparse_data(datafile, entries, changelog_mark=None,
+                 fsync=FSYNC_DATA, author_name=None, author_global=False):
+    """Unparse ENTRIES (as accepted by serialize_data(), along with
+    AUTHOR_NAME and AUTHOR_GLOBAL) into an XML file -- compressed, if
+    DATAFILE's extension calls for it (see get_compression()) -- using an
     intermediate tempfile to try to reduce the chances of clobbering a
-    previously-good datafile with a half-baked one."""
-    fdesc, fname = tempfile.mkstemp()
-    fp = os.fdopen(fdesc, 'w', encoding='utf-8')
+    previously-good datafile with a half-baked one.  The tempfile lives
+    alongside DATAFILE, so that it can be atomically renamed into place
+    (rather than copied there from some other volume).  FSYNC selects
+    how hard we try to ensure the new DATAFILE survives a crash:
+    FSYNC_NEVER, FSYNC_DATA (flush its contents to disk before the
+    rename; the default), or FSYNC_FULL (also flush the rename itself).
+
+    Once DATAFILE is written, its change log is discarded -- or, if
+    CHANGELOG_MARK (from get_changelog_mark()) is provided, just the
+    records logged before that mark was taken, which are the ones
+    already reflected in ENTRIES.  Records
+    appended after ENTRIES were captured must survive, but the older
+    ones mustn't be replayed atop DATAFILE:  changes which aren't
+    logged (such as tag renames) would be undone."""
+    if fsync not in (FSYNC_NEVER, FSYNC_DATA, FSYNC_FULL):
+        raise Exception(f'Unknown fsync policy "{fsync}"')
+    datafile_dir = os.path.dirname(os.path.abspath(datafile))
+    fdesc, fname = tempfile.mkstemp(
+        prefix='.%s.' % (os.path.basename(datafile)), suffix='.tmp',
+        dir=datafile_dir)
+    fp = os.fdopen(fdesc, 'wb', buffering=WRITE_BUFFER_SIZE)
     try:
-        fp.write('<?xml version="1.0"?>\n'
-                 '<diary version="%d">\n' % (TK_DATA_VERSION))
-        if not entries:
+        if entries is None:
             entries = TKEntries()
-        if entries.get_author_name() is not None:
-            fp.write(' <author global="%s">%s</author>\n'
-                     % (entries.get_author_global() and "true" or "false",
-                        _xml_escape(entries.get_author_name())))
-        fp.write(' <entries>\n')
-
-        def _write_entry(entry):
-            year, month, day = entry.get_date()
-            id = entry.get_id()
-            tags = entry.get_tags()
-            fp.write('  <entry year="%s" month="%s" day="%s" id="%s">\n'
-                     % (year, month, day, id))
-            author = entry.get_author()
-            if author:
-                fp.write('   <author>%s</author>\n'
-                         % (_xml_escape(author)))
-            subject = entry.get_subject()
-            if subject:
-                fp.write('   <subject>%s</subject>\n'
-                         % (_xml_escape(subject)))
-            if len(tags):
-                fp.write('   <tags>\n')
-                for tag in tags:
-                    fp.write('    <tag>%s</tag>\n'
-                             % (_xml_escape(tag)))
-                fp.write('   </tags>\n')
-            fp.write('   <text>%s</text>\n'
-                     % (_xml_escape(entry.get_text())))
-            fp.write('  </entry>\n')
-        entries.enumerate_entries(_write_entry)
-        fp.write(' </entries>\n</diary>\n')
+        zfp = _compressed_file(fp, get_compression(datafile), 'wb')
+        for chunk in serialize_data(entries, author_name, author_global):
+            zfp.write(chunk.encode('utf-8'))
+        if zfp is not fp:
+            zfp.close()
+        fp.flush()
+        if fsync != FSYNC_NEVER:
+            os.fsync(fp.fileno())
         fp.close()
-        # We use shutil.move() instead of os.rename() because the former
-        # can deal with moves across volumes while the latter cannot.
-        shutil.move(fname, datafile)
+        os.replace(fname, datafile)
+        if fsync == FSYNC_FULL:
+            _fsync_dir(datafile_dir)
+
+        # DATAFILE is now complete, so any changes logged against its
+        # previous contents are obsolete.
+        with _changelog_lock:
+            _discard_changelog(datafile, changelog_mark)
     finally:
+        fp.close()
         if os.path.exists(fname):
             os.unlink(fname)
+
+
+def _discard_changelog(datafile, mark=None):
+    """Discard the records logged to the change log for DATAFILE before
+    MARK (as returned by get_changelog_mark()) was taken -- or, if MARK
+    is None, all of them -- keeping any appended since.  The caller must
+    hold _changelog_lock."""
+    changelog = os.path.abspath(get_changelog_path(datafile))
+    try:
+        log_size = os.path.getsize(changelog)
+    except OSError:
+        return
+    discarded = _changelog_discarded.get(changelog, 0)
+    size = log_size
+    if mark is not None:
+        # Another save may have trimmed some (or all) of the records
+        # before MARK already.
+        size = min(mark - discarded, log_size)
+        if size <= 0:
+            return
+    if size == log_size:
+        os.unlink(changelog)
+        _changelog_discarded[changelog] = discarded + size
+        return
+
+    # Records are only ever appended whole (under _changelog_lock), and
+    # marks and trims are taken under it too, so SIZE falls on a record
+    # boundary.  The remainder replaces the log in the same
+    # all-or-nothing way as the datafile itself.
+    with open(changelog, 'rb') as fp:
+        fp.seek(size)
+        later = fp.read()
+    fdesc, fname = tempfile.mkstemp(
+        prefix='.%s.' % (os.path.basename(changelog)), suffix='.tmp',
+        dir=os.path.dirname(changelog))
+    try:
+        with os.fdopen(fdesc, 'wb') as fp:
+            fp.write(later)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(fname, changelog)
+        _changelog_discarded[changelog] = discarded + size
+    finally:
+        if os.path.exists(fname):
+            os.unlink(fname)
+
+
+def _fsync_dir(path):
+    """Flush the directory PATH (and so, the entries within it) to
+    disk, where the platform allows it."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
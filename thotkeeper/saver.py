@@ -0,0 +1,144 @@
+# ThotKeeper -- a personal daily journal application.
+#
+# Copyright (c) 2004-2025 C. Michael Pilato.  All rights reserved.
+#
+# By using this file, you agree to the terms and conditions set forth in
+# the LICENSE file which can be found at the top level of the ThotKeeper
+# distribution.
+#
+# Website: https://github.com/cmpilato/thotkeeper
+
+"""Background, debounced saving of diary data files.
+
+Writing out a large diary takes a while, so rather than doing so each
+time it's asked, TKSaveScheduler snapshots the entries to be saved and
+writes them out on a worker thread once no further save of the same
+datafile has been requested for a little while.  Only the most recent
+snapshot of each datafile is ever written."""
+
+import threading
+import time
+from .parser import (FSYNC_DATA, get_changelog_mark, unparse_data)
+
+# Default number of seconds to wait for further saves of a datafile
+# before writing it out.
+DEFAULT_SAVE_DELAY = 2.0
+
+
+class TKEntriesSnapshot:
+    """A frozen copy of the contents of a TKEntries object, suitable
+    for passing to unparse_data() while the original changes."""
+
+    def __init__(self, entries):
+        self.author_name = entries.get_author_name()
+        self.author_global = entries.get_author_global()
+        # TKEntries replaces, rather than modifies, the TKEntry objects
+        # it holds (even when renaming tags), so there's no need to copy
+        # the entries themselves.
+        self.entries = list(entries.iter_range())
+
+    def get_author_name(self):
+        return self.author_name
+
+    def get_author_global(self):
+        return self.author_global
+
+    def enumerate_entries(self, func):
+        for entry in self.entries:
+            func(entry)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+
+class TKSaveScheduler:
+    """Writes snapshots of TKEntries objects to their datafiles on a
+    worker thread, coalescing the saves of each datafile requested
+    within DELAY seconds of each other.  FSYNC is the fsync policy
+    passed to unparse_data().  If provided, DONE_FUNC is
+    called (from the worker thread) as DONE_FUNC(DATAFILE, ERROR) after
+    each write, with ERROR being None on success or the exception which
+    caused the write to fail."""
+
+    def __init__(self, delay=DEFAULT_SAVE_DELAY, done_func=None,
+                 fsync=FSYNC_DATA):
+        self.delay = delay
+        self.done_func = done_func
+        self.fsync = fsync
+        self.cond = threading.Condition()
+        self.pending = {}  # datafile -> (due time, snapshot, log mark)
+        self.writing = None
+        self.thread = None
+
+    def schedule(self, datafile, entries):
+        """Arrange for ENTRIES, as they stand now, to be written to
+        DATAFILE once DELAY seconds pass without another save of
+        DATAFILE being scheduled."""
+        # Changes logged after this point aren't in the snapshot, so
+        # the write mustn't discard them (see unparse_data()).
+        item = (time.monotonic() + self.delay, TKEntriesSnapshot(entries),
+                get_changelog_mark(datafile))
+        with self.cond:
+            self.pending[datafile] = item
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run,
+                                               name='TKSaveWorker')
+                self.thread.start()
+            self.cond.notify_all()
+
+    def is_pending(self, datafile=None):
+        """Return True iff a save of DATAFILE (or, if DATAFILE is
+        None, of any datafile) is scheduled or being written."""
+        with self.cond:
+            if datafile is None:
+                return bool(self.pending) or self.writing is not None
+            return datafile in self.pending or self.writing == datafile
+
+    def save(self, datafile, entries):
+        """Write ENTRIES to DATAFILE immediately (in the calling
+        thread), superseding any scheduled save of DATAFILE."""
+        with self.cond:
+            self.pending.pop(datafile, None)
+            while self.writing == datafile:
+                self.cond.wait()
+            unparse_data(datafile, entries, fsync=self.fsync)
+
+    def flush(self):
+        """Write out all scheduled saves immediately, returning once
+        they are complete."""
+        with self.cond:
+            for datafile, (due, snapshot, log_mark) in self.pending.items():
+                self.pending[datafile] = (0, snapshot, log_mark)
+            self.cond.notify_all()
+            while self.pending or self.writing is not None:
+                self.cond.wait()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while True:
+                    if not self.pending:
+                        # The worker exits when idle, so that it never
+                        # holds up the exit of the process.
+                        self.thread = None
+                        self.cond.notify_all()
+                        return
+                    datafile = min(self.pending,
+                                   key=lambda x: self.pending[x][0])
+                    delay = self.pending[datafile][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self.cond.wait(delay)
+                due, snapshot, log_mark = self.pending.pop(datafile)
+                self.writing = datafile
+
+            error = None
+            try:
+                unparse_data(datafile, snapshot, log_mark, self.fsync)
+            except Exception as e:
+                error = e
+            if self.done_func is not None:
+                self.done_func(datafile, error)
+            with self.cond:
+                self.writing = None
+                self.cond.notify_all()
@@ -0,0 +1,222 @@
+# ThotKeeper -- a personal daily journal application.
+#
+# Copyright (c) 2004-2025 C. Michael Pilato.  All rights reserved.
+#
+# By using this file, you agree to the terms and conditions set forth in
+# the LICENSE file which can be found at the top level of the ThotKeeper
+# distribution.
+#
+# Website: https://github.com/cmpilato/thotkeeper
+
+import re
+from array import array
+from collections import defaultdict
+
+_token_re = re.compile(r'\w+')
+_word_char_re = re.compile(r'\w')
+_query_re = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def tokenize(text):
+    """Return the list of (lowercased) word tokens found in TEXT."""
+    return _token_re.findall(text.lower())
+
+
+def parse_query(query):
+    """Parse the search string QUERY, returning a list of clauses, any
+    one of which an entry must satisfy to match the query.  Each clause
+    is a list of terms, all of which must be found in an entry for it
+    to satisfy the clause.  Each term is a tuple of one or more tokens;
+    a multi-token term is a phrase whose tokens must appear adjacent
+    (and in order) in the entry's subject, text, or a tag.
+
+    Query terms are separated by whitespace and implicitly ANDed
+    together; the word OR separates alternative clauses, and double
+    quotes delimit phrases.  For example:
+
+       garden "red roses" OR travel/europe
+    """
+    clauses = [[]]
+    for match in _query_re.finditer(query):
+        phrase, word = match.groups()
+        if word == 'OR':
+            clauses.append([])
+            continue
+        if word == 'AND':
+            continue
+        term = tuple(tokenize(phrase if phrase is not None else word))
+        if term:
+            clauses[-1].append(term)
+    return [clause for clause in clauses if clause]
+
+
+def _phrase_regexp(phrase):
+    """Return a compiled regular expression which finds the tokens
+    of PHRASE as adjacent tokens in lowercased (but untokenized) text,
+    for use with _has_phrase()."""
+    # The expression deliberately starts with a literal rather than a
+    # word-boundary assertion, which lets the regexp engine scan for
+    # candidates much more quickly.  _has_phrase() checks the leading
+    # boundary itself.
+    return re.compile(r'\W+'.join(map(re.escape, phrase)) + r'(?!\w)')
+
+
+def _has_phrase(phrase_re, text):
+    """Return True iff the lowercased TEXT contains the phrase sought
+    by PHRASE_RE (as returned by _phrase_regexp())."""
+    match = phrase_re.search(text)
+    while match:
+        start = match.start()
+        if start == 0 or not _word_char_re.match(text, start - 1):
+            return True
+        match = phrase_re.search(text, start + 1)
+    return False
+
+
+def _scan_clause(clause, texts, all_text):
+    """Return True iff an entry whose lowercased subject, text, and
+    tags are TEXTS (and, joined, ALL_TEXT) satisfies CLAUSE, a list of
+    (term, phrase regexp) pairs."""
+    for term, phrase_re in clause:
+        # Only run the regexps over the entries which might match.
+        for token in term:
+            if token not in all_text:
+                return False
+        for text in texts:
+            if _has_phrase(phrase_re, text):
+                break
+        else:
+            return False
+    return True
+
+
+def search_entries(entries, query):
+    """Return the keys -- (year, month, day, id) tuples -- of the
+    entries in the TKEntries object ENTRIES which match the search
+    string QUERY (see parse_query()), in date order.  Unlike
+    TKSearchIndex, this scans every entry, which is quicker for
+    answering a single query than building the index would be."""
+    clauses = [[(term, _phrase_regexp(term)) for term in clause]
+               for clause in parse_query(query)]
+    matches = []
+
+    def _scan_entry(entry):
+        texts = (entry.get_subject(), entry.get_text()) + entry.get_tags()
+        texts = [text.lower() for text in texts]
+        all_text = '\n'.join(texts)
+        for clause in clauses:
+            if _scan_clause(clause, texts, all_text):
+                matches.append((entry.year, entry.month, entry.day,
+                                entry.id))
+                return
+    entries.enumerate_entries(_scan_entry)
+    return matches
+
+
+class TKSearchIndex:
+    """An inverted index of the tokens found in the subjects, texts,
+    and tags of a TKEntries object's entries, for fast full-text
+    searches.  Alongside each token's entries, the index records each
+    entry's sequence of tokens (as a packed array of token numbers), so
+    phrases are matched without rereading the entries' texts.  Once
+    built, the index keeps itself current by listening for changes to
+    the entries.  (Bulk operations which bypass the entry listeners,
+    such as TKEntries.split(), call for a rebuild().)"""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.postings = defaultdict(set)  # token -> set of entry keys
+        self.entry_tokens = {}            # entry key -> tokens
+        self.token_streams = {}           # entry key -> token numbers
+        self.token_numbers = {}           # token -> token number
+        self.rebuild()
+        entries.register_listener(self.entry_changed_listener)
+
+    def rebuild(self):
+        """(Re)build the index from scratch."""
+        self.postings = defaultdict(set)
+        self.entry_tokens = {}
+        self.token_streams = {}
+        self.token_numbers = {}
+        self.entries.enumerate_entries(self._add_entry)
+
+    def _add_entry(self, entry):
+        entry_key = (entry.year, entry.month, entry.day, entry.id)
+        texts = (entry.get_subject(), entry.get_text()) + entry.get_tags()
+        fields = [tokenize(text) for text in texts]
+        tokens = set().union(*fields)
+        token_numbers = self.token_numbers
+        for token in tokens:
+            if token not in token_numbers:
+                # (Numbers aren't reused, but the vocabulary of a diary
+                # is only so large.)
+                token_numbers[token] = len(token_numbers) + 1
+        stream = array('I')
+        for field in fields:
+            stream.extend(map(token_numbers.__getitem__, field))
+            # Number 0 separates the fields, so that no phrase spans
+            # two of them.
+            stream.append(0)
+        self.entry_tokens[entry_key] = tuple(tokens)
+        self.token_streams[entry_key] = stream.tobytes()
+        postings = self.postings
+        for token in tokens:
+            postings[token].add(entry_key)
+
+    def _remove_entry_key(self, entry_key):
+        self.token_streams.pop(entry_key, None)
+        for token in self.entry_tokens.pop(entry_key, ()):
+            entry_keys = self.postings[token]
+            entry_keys.discard(entry_key)
+            if not entry_keys:
+                del self.postings[token]
+
+    def entry_changed_listener(self, entry, year, month, day, id):
+        """Callback for TKEntries.store_entry() and remove_entry()."""
+        self._remove_entry_key((year, month, day, id))
+        if entry is not None:
+            self._add_entry(entry)
+
+    def _match_clause(self, clause):
+        token_sets = []
+        for term in clause:
+            for token in term:
+                entry_keys = self.postings.get(token)
+                if not entry_keys:
+                    return set()
+                token_sets.append(entry_keys)
+
+        # Intersect the smallest posting sets first.
+        token_sets.sort(key=len)
+        matches = token_sets[0].intersection(*token_sets[1:])
+        for term in clause:
+            if len(term) > 1:
+                matches = self._match_phrase(term, matches)
+        return matches
+
+    def _match_phrase(self, phrase, entry_keys):
+        """Return the set of those of ENTRY_KEYS whose entries contain
+        all the tokens of PHRASE, adjacent and in order."""
+        numbers = array('I', [self.token_numbers[token] for token in phrase])
+        needle = numbers.tobytes()
+        size = numbers.itemsize
+        token_streams = self.token_streams
+        matches = set()
+        for entry_key in entry_keys:
+            stream = token_streams[entry_key]
+            index = stream.find(needle)
+            # Only matches which start on a token number count.
+            while index > 0 and index % size:
+                index = stream.find(needle, index + 1)
+            if index >= 0:
+                matches.add(entry_key)
+        return matches
+
+    def search(self, query):
+        """Return the keys -- (year, month, day, id) tuples -- of the
+        entries which match the search string QUERY (see
+        parse_query()), in date order."""
+        matches = set()
+        for clause in parse_query(query):
+            matches.update(self._match_clause(clause))
+        return sorted(matches)